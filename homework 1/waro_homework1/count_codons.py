@@ -1,6 +1,44 @@
-import sys, re
+import sys, re, os
+import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
-def main(input_path, output_path):
+# the compressed file readers are shared by every homework (seqio.py, two
+# directories up)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from seqio import open_text
+
+# 2-bit code of each base, indexed by its ascii value. 255 marks any non-ACGT character
+BASE_CODES = np.full(256, 255, dtype=np.uint8)
+BASE_CODES[[ord(base) for base in "ACGT"]] = np.arange(4)
+
+# the same, with soft-masked (lowercase) bases mapped like their uppercase ones, for translation
+FOLDED_CODES = BASE_CODES.copy()
+FOLDED_CODES[[ord(base) for base in "acgt"]] = np.arange(4)
+
+# 3-bit code of each base, the high bit set for soft-masked (lowercase) bases, so codon counting stays case-sensitive
+CASED_CODES = np.full(256, 255, dtype=np.uint8)
+CASED_CODES[[ord(base) for base in "ACGTacgt"]] = np.arange(8)
+
+# every codon, positioned at its 6-bit index (first base in the high bits)
+CODONS = [a + b + c for a in "ACGT" for b in "ACGT" for c in "ACGT"]
+
+# every upper/lowercase codon, positioned at its 9-bit index from CASED_CODES
+CASED_CODONS = [a + b + c for a in "ACGTacgt" for b in "ACGTacgt" for c in "ACGTacgt"]
+
+# one letter amino acids, '*' being a stop codon
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY*"
+
+# the standard genetic code, listed in TCAG order
+GENETIC_CODE = "FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG"
+
+# index in AMINO_ACIDS of the amino acid coded by each 6-bit codon index
+CODON_AMINO = np.array([
+  AMINO_ACIDS.index(GENETIC_CODE[sum(4 ** (2 - i) * "TCAG".index(base) for i, base in enumerate(codon))])
+  for codon in CODONS
+], dtype=np.uint8)
+
+def main(input_path, output_path, mode="whole"):
   """
     Main function to count_codons. Responsible for orchestrating the opening and parsing of sequence data, creating a frequency map of codons, and outputting the counts to the specified output file.
 
@@ -8,10 +46,20 @@ def main(input_path, output_path):
     ----------
     @param input_path {str}: the file location of the input sequence data
     @param output_path {str}: the location to put the output file
+    @param mode {str}: "whole" loads the genome into memory before counting, "stream" counts it chunk by chunk in constant memory, "numpy" uses the vectorized counting engine, "records" counts each FASTA record separately across a process pool, "amino" counts the translated amino acids of each record
   """
 
-  sequence_data = open_file(input_path)
-  codon_map = count_codons(sequence_data)
+  if mode == "amino":
+    codon_map = translate_records(input_path, output_path)
+  elif mode == "records":
+    codon_map = count_records(input_path, output_path)
+  elif mode == "stream":
+    codon_map = stream_codons(input_path)
+  elif mode == "numpy":
+    codon_map = count_codons_numpy(open_file(input_path))
+  else:
+    sequence_data = open_file(input_path)
+    codon_map = count_codons(sequence_data)
   output_frequencies(codon_map, output_path)
 
   return "done"
@@ -30,7 +78,7 @@ def open_file(input_path):
   bases = re.compile("[^ATCGatcg]")
 
   # open file, and add build sequence data
-  with open(input_path) as in_file:
+  with open_text(input_path) as in_file:
     li = in_file.readline()
     count = 0
     while li:
@@ -41,6 +89,64 @@ def open_file(input_path):
 
   return "".join(sequence_data)
 
+def read_sequence_chunks(input_path, chunk_size=1 << 20):
+  """
+    This function reads the input data file in fixed-size chunks, yielding only the sequence data. Lines are filtered the same way as open_file, so joining the chunks gives the same string open_file returns.
+
+    @param input_path {str}: the file location of the input sequence data
+    @param chunk_size {int}: the number of characters to read from the file at a time
+    @returns {generator(str)}: pieces of the sequence data, each at most chunk_size long
+  """
+
+  # regex to filter out non-sequence related text
+  bases = re.compile("[^ATCGatcg]")
+
+  line_start = True # the next character read begins a new line
+  keep_line = False # the current line holds sequence data
+
+  with open_text(input_path) as in_file:
+    chunk = in_file.read(chunk_size)
+    while chunk:
+      pieces = []
+      for i, piece in enumerate(chunk.split("\n")):
+        if i > 0: line_start = True
+
+        # a line can only be classified once its first character has been read
+        if line_start and piece:
+          keep_line = bases.match(piece) == None
+          line_start = False
+
+        if keep_line and not line_start and piece:
+          pieces.append(piece)
+
+      if pieces: yield "".join(pieces)
+      chunk = in_file.read(chunk_size)
+
+def open_records(input_path):
+  """
+    This function opens the input data file, and parses each FASTA record (gene) from it separately. Sequence lines are filtered the same way as open_file.
+
+    @param input_path {str}: the file location of the input sequence data
+    @returns {generator((str, str))}: the (record id, sequence data) of each record, in file order
+  """
+
+  # regex to filter out non-sequence related text
+  bases = re.compile("[^ATCGatcg]")
+
+  record_id, sequence_data = None, []
+
+  with open_text(input_path) as in_file:
+    li = in_file.readline()
+    while li:
+      if li.startswith(">"):
+        if sequence_data: yield (record_id, "".join(sequence_data))
+        record_id, sequence_data = li[1:].strip(), []
+      elif bases.match(li) == None:
+        sequence_data.append(li.replace("\n", ""))
+      li = in_file.readline()
+
+  if sequence_data: yield (record_id, "".join(sequence_data))
+
 def count_codons(sequence_data):
   """
     This function creates a python dictionary / mapping of the number of each codon in the sequence data.
@@ -50,6 +156,19 @@ def count_codons(sequence_data):
   """
 
   codon_map = {}
+  update_codons(codon_map, sequence_data)
+
+  return codon_map
+
+def update_codons(codon_map, sequence_data):
+  """
+    This function adds the codons of the sequence data to an existing codon mapping, leaving any trailing partial codon uncounted.
+
+    @param codon_map {dict}: the counts of each codon, updated in place.
+    @param sequence_data {str}: the sequence data string to be parsed.
+    @returns {str}: the 0-2 trailing bases that did not make up a full codon.
+  """
+
   stop, size = 3, len(sequence_data)
 
   # step through sequence with a window size of 3 to count codons
@@ -62,9 +181,201 @@ def count_codons(sequence_data):
       codon_map[codon] = codon_map[codon] + 1
 
     stop += 3 # move window to next codon
-  
+
+  return sequence_data[stop - 3:]
+
+def encode_codons(sequence_data, table=BASE_CODES, bits=2):
+  """
+    This function converts the sequence data into codon indices. Bases are mapped to 2-bit codes with a lookup table (BASE_CODES by default), giving 6-bit codon indices, and the three bases of each codon are taken from strided views of the encoded sequence. With 3-bit codes (CASED_CODES) the indices are 9-bit.
+
+    @param sequence_data {str}: the sequence data string to be parsed.
+    @param table {np.ndarray}: the code of each base (255 for anything else), indexed by its ascii value
+    @param bits {int}: the number of bits of each base code, 2 or 3
+    @returns (index, valid) {(np.ndarray, np.ndarray)}: the codon index of every full codon (uint8, uint16 for 3-bit codes), and a mask of the codons made up of only bases in the table.
+  """
+
+  size = len(sequence_data) // 3 * 3 # drop the trailing partial codon
+  codes = table[np.frombuffer(sequence_data[:size].encode("ascii", "replace"), dtype=np.uint8)]
+  if bits > 2: codes = codes.astype(np.uint16) # 9-bit indices
+
+  first, second, third = codes[0::3], codes[1::3], codes[2::3]
+  valid = (first | second | third) < (1 << bits) # any 255 code sets the high bits
+  index = (first << (2 * bits)) | (second << bits) | third
+
+  return index, valid
+
+def count_codons_numpy(sequence_data, block_size=4096):
+  """
+    This function is a vectorized drop-in replacement for count_codons. The bases are encoded case-sensitively with CASED_CODES, so soft-masked (lowercase) codons keep their own counts like in count_codons, and the 512-entry frequency table comes from a single bincount over the codon indices, so no per-codon strings are created.
+
+    @param sequence_data {str}: the sequence data string to be parsed.
+    @param block_size {int}: the number of codons scanned at a time when looking for the first occurrence of each codon
+    @returns codon_map {dict}: the counts of each codon, identical (including key order) to count_codons(sequence_data).
+  """
+
+  index, valid = encode_codons(sequence_data, CASED_CODES, 3)
+  counts = np.bincount(index[valid], minlength=512)
+  present = np.count_nonzero(counts)
+
+  # count_codons orders its keys by first occurrence, so find where each codon first appears.
+  # every codon has normally been seen within the first few blocks
+  first_seen = {}
+  start = 0
+  while len(first_seen) < present:
+    block_valid = valid[start:start + block_size]
+    codes, positions = np.unique(index[start:start + block_size][block_valid], return_index=True)
+    positions = np.flatnonzero(block_valid)[positions] + start
+    for code, position in zip(codes.tolist(), positions.tolist()):
+      first_seen.setdefault(code, position)
+    start += block_size
+
+  found = [(first_seen[code], CASED_CODONS[code], int(counts[code])) for code in first_seen]
+
+  # codons containing anything besides ACGT/acgt are rare, so they are counted one by one
+  other_map, other_seen = {}, {}
+  for position in np.flatnonzero(~valid).tolist():
+    codon = sequence_data[3 * position : 3 * position + 3]
+    other_seen.setdefault(codon, position)
+    other_map[codon] = other_map.get(codon, 0) + 1
+  found += [(other_seen[codon], codon, other_map[codon]) for codon in other_map]
+
+  return {codon: count for position, codon, count in sorted(found)}
+
+def stream_codons(input_path, chunk_size=1 << 20):
+  """
+    This function creates the codon mapping without holding the whole genome in memory. The file is read in fixed-size chunks, and the leftover 0-2 bases of each chunk are carried over to the next one so codons spanning a chunk boundary are still counted.
+
+    @param input_path {str}: the file location of the input sequence data
+    @param chunk_size {int}: the number of characters to read from the file at a time
+    @returns codon_map {dict}: the counts of each codon, identical to count_codons(open_file(input_path)).
+  """
+
+  codon_map = {}
+  carry = ""
+
+  for chunk in read_sequence_chunks(input_path, chunk_size):
+    carry = update_codons(codon_map, carry + chunk)
+
   return codon_map
   
+def merge_codons(codon_map, other_map):
+  """
+    This function adds the counts of one codon mapping into another, keeping the first-occurrence key order.
+
+    @param codon_map {dict}: the counts of each codon, updated in place.
+    @param other_map {dict}: the counts to be added.
+  """
+
+  for codon in other_map:
+    codon_map[codon] = codon_map.get(codon, 0) + other_map[codon]
+
+def count_batch(batch):
+  """
+    This function counts the codons of a batch of records independently. It is the unit of work handed to each worker process.
+
+    @param batch {list((str, str))}: the (record id, sequence data) of each record in the batch
+    @returns (gene_maps, batch_map) {(list((str, dict)), dict)}: the codon mapping of each record, and their merged total
+  """
+
+  gene_maps, batch_map = [], {}
+
+  for record_id, sequence_data in batch:
+    codon_map = count_codons_numpy(sequence_data)
+    gene_maps.append((record_id, codon_map))
+    merge_codons(batch_map, codon_map)
+
+  return (gene_maps, batch_map)
+
+def count_records(input_path, output_path, workers=None, batch_size=64):
+  """
+    This function counts the codons of every FASTA record (gene) on its own, so reading frames restart at each gene. Batches of records are spread over a process pool, and the per-gene rows are written to <output_path>_genes.csv in the format: gene,codon,frequency\n as the batches finish, in file order.
+
+    @param input_path {str}: the file location of the input sequence data
+    @param output_path {str}: the location of the whole-genome output file, used to name the per-gene file
+    @param workers {int}: the number of worker processes, defaults to the number of cpus
+    @param batch_size {int}: the number of records handed to a worker at a time
+    @returns codon_map {dict}: the whole-genome counts of each codon, merged from the per-batch tables
+  """
+
+  workers = workers or os.cpu_count()
+  genes_path = output_path.replace(".csv", "") + "_genes.csv"
+
+  codon_map = {}
+  records = open_records(input_path)
+  pending = deque() # batches in flight, oldest first
+  separator = ""
+
+  with ProcessPoolExecutor(workers) as pool, open(genes_path, "w") as output:
+    while True:
+      # keep a bounded number of batches in flight so memory doesn't grow with the file
+      while len(pending) < 2 * workers:
+        batch = [record for _, record in zip(range(batch_size), records)]
+        if not batch: break
+        pending.append(pool.submit(count_batch, batch))
+
+      if not pending: break
+
+      # write the oldest batch, which keeps the rows in file order
+      gene_maps, batch_map = pending.popleft().result()
+      for record_id, gene_map in gene_maps:
+        gene = record_id.split()[0] if record_id else ""
+        for codon in gene_map:
+          output.write(separator + gene + "," + codon + "," + str(gene_map[codon]))
+          separator = "\n"
+      merge_codons(codon_map, batch_map)
+
+  return codon_map
+
+def count_amino_acids(records):
+  """
+    This function translates a batch of records and counts the amino acids of each one. All the records are encoded together, the codon indices are translated through the CODON_AMINO lookup array, and a single bincount over (record, amino acid) pairs gives the per-record counts. Soft-masked (lowercase) codons translate like uppercase ones, and codons containing anything besides ACGT/acgt are skipped.
+
+    @param records {list((str, str))}: the (record id, sequence data) of each record
+    @returns (gene_counts, total_counts) {(np.ndarray, np.ndarray)}: the amino acid counts of each record (one row per record, one column per AMINO_ACIDS letter), and their sum
+  """
+
+  # trim each record to whole codons so the reading frame restarts with every record
+  trimmed = [sequence_data[:len(sequence_data) // 3 * 3] for _, sequence_data in records]
+  index, valid = encode_codons("".join(trimmed), FOLDED_CODES)
+  genes = np.repeat(np.arange(len(trimmed)), [len(sequence_data) // 3 for sequence_data in trimmed])
+
+  amino = CODON_AMINO[index[valid]].astype(np.intp)
+  size = len(AMINO_ACIDS)
+  gene_counts = np.bincount(genes[valid] * size + amino, minlength=len(trimmed) * size).reshape(len(trimmed), size)
+
+  return (gene_counts, gene_counts.sum(axis=0))
+
+def translate_records(input_path, output_path, batch_size=4096):
+  """
+    This function counts the amino acids coded by every FASTA record (gene), writing the per-gene rows to <output_path>_genes.csv in the format: gene,amino_acid,frequency\n. Records are translated a batch at a time.
+
+    @param input_path {str}: the file location of the input sequence data
+    @param output_path {str}: the location of the whole-genome output file, used to name the per-gene file
+    @param batch_size {int}: the number of records translated together
+    @returns amino_map {dict}: the whole-genome counts of each amino acid
+  """
+
+  genes_path = output_path.replace(".csv", "") + "_genes.csv"
+
+  total_counts = np.zeros(len(AMINO_ACIDS), dtype=np.int64)
+  records = open_records(input_path)
+  separator = ""
+
+  with open(genes_path, "w") as output:
+    batch = [record for _, record in zip(range(batch_size), records)]
+    while batch:
+      gene_counts, batch_counts = count_amino_acids(batch)
+      for (record_id, _), counts in zip(batch, gene_counts.tolist()):
+        gene = record_id.split()[0] if record_id else ""
+        for amino, count in zip(AMINO_ACIDS, counts):
+          if count:
+            output.write(separator + gene + "," + amino + "," + str(count))
+            separator = "\n"
+      total_counts += batch_counts
+      batch = [record for _, record in zip(range(batch_size), records)]
+
+  return {amino: int(count) for amino, count in zip(AMINO_ACIDS, total_counts) if count}
+
 def output_frequencies(codon_map, output_path):
   """
     This function writes the counts of codon frequencies to an output .csv file in the format: codon,frequency\n
@@ -89,4 +400,7 @@ def output_frequencies(codon_map, output_path):
       output.write(li)
 
 if __name__ == "__main__":
-  main(sys.argv[1], sys.argv[2])
\ No newline at end of file
+  if len(sys.argv) > 3:
+    main(sys.argv[1], sys.argv[2], sys.argv[3])
+  else:
+    main(sys.argv[1], sys.argv[2])
\ No newline at end of file
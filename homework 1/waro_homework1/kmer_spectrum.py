@@ -0,0 +1,150 @@
+import sys
+import numpy as np
+from count_codons import FOLDED_CODES, read_sequence_chunks, output_frequencies
+
+# largest k counted into a dense 4^k array, larger k are counted into hash tables
+DENSE_LIMIT = 10
+
+def main(input_path, output_path, k_values=(2, 3, 6)):
+  """
+    Main function to kmer_spectrum. Responsible for counting the k-mer spectrum of the sequence data for every requested k, and outputting one frequency file per k and reading frame.
+
+    Parameters
+    ----------
+    @param input_path {str}: the file location of the input sequence data
+    @param output_path {str}: the location to put the output files, each one is suffixed with its k and frame
+    @param k_values {tuple(int)}: the k-mer sizes to count
+  """
+
+  spectrum = kmer_spectrum(read_sequence_chunks(input_path), k_values)
+  output_spectrum(spectrum, output_path)
+
+  return "done"
+
+def kmer_spectrum(chunks, k_values):
+  """
+    This function counts the k-mers of several sizes, in every reading frame of both strands, in a single pass over the sequence data.
+
+    Every k-mer is rolled into an integer (2 bits per base) by extending the (k - 1)-mer codes one base at a time, so the codes of all the requested sizes are built together and no k-mer strings are sliced. The reverse complement codes are rolled alongside. A k-mer's frame is its start position modulo k, counted from the 5' end of its own strand. Soft-masked (lowercase) bases are folded into uppercase (FOLDED_CODES), so the k-mers count_codons keeps as separate lowercase entries are added to their uppercase counts here. K-mers containing anything besides ACGT/acgt are skipped.
+
+    The input is treated as a single sequence, the same as open_file and the whole genome counts of count_codons: the records of a multi-record file are joined, so k-mers and frames run across record boundaries.
+
+    @param chunks {iterable(str)}: pieces of the sequence data, e.g. from read_sequence_chunks
+    @param k_values {iterable(int)}: the k-mer sizes to count (1 - 31)
+    @returns spectrum {dict}: maps (k, strand, frame) to the counts for that frame, strand being "+" or "-". Counts are a dense np.ndarray of length 4^k when k <= DENSE_LIMIT, or a {code: count} dict otherwise.
+  """
+
+  k_values = sorted(set(k_values))
+  k_max = k_values[-1]
+
+  spectrum = {}
+  for k in k_values:
+    for strand in "+-":
+      for frame in range(k):
+        spectrum[(k, strand, frame)] = np.zeros(4 ** k, dtype=np.int64) if k <= DENSE_LIMIT else {}
+
+  carry = np.empty(0, dtype=np.uint8) # the last k_max - 1 bases of the previous chunk
+  offset = 0 # position of carry[0] in the whole sequence
+
+  for chunk in chunks:
+    codes = np.concatenate((carry, FOLDED_CODES[np.frombuffer(chunk.encode("ascii", "replace"), dtype=np.uint8)]))
+    bases = codes.astype(np.int64) & 3
+    invalid = codes > 3
+
+    forward = np.zeros(len(codes), dtype=np.int64) # code of the k-mer starting at each position
+    reverse = np.zeros(len(codes), dtype=np.int64) # code of its reverse complement
+    bad = np.zeros(len(codes), dtype=bool) # the k-mer holds a non-ACGT base
+
+    for k in range(1, k_max + 1):
+      # extend every (k - 1)-mer by the base that follows it
+      starts = len(codes) - k + 1
+      if starts <= 0: break
+      forward = (forward[:starts] << 2) | bases[k - 1:]
+      reverse = reverse[:starts] | ((3 - bases[k - 1:]) << (2 * (k - 1)))
+      bad = bad[:starts] | invalid[k - 1:]
+
+      if k not in k_values: continue
+
+      # k-mers starting in the carry that were not complete in the previous chunk, up to the
+      # ones that may still be extended by the next chunk, are counted exactly once
+      first = max(0, len(carry) - k + 1)
+      positions = np.arange(first, starts) + offset
+      keep = ~bad[first:]
+
+      count_frames(spectrum, k, "+", forward[first:][keep], positions[keep] % k)
+      # the reverse strand frame depends on the sequence length, so it is kept relative to
+      # the forward strand here and converted once the length is known
+      count_frames(spectrum, k, "-", reverse[first:][keep], positions[keep] % k)
+
+    carry = codes[max(0, len(codes) - k_max + 1):]
+    offset += len(codes) - len(carry)
+
+  # a reverse strand k-mer starting at forward position p starts at length - p - k on its own strand
+  length = offset + len(carry)
+  for k in k_values:
+    shift = length % k
+    reverse_frames = [spectrum[(k, "-", frame)] for frame in range(k)]
+    for frame in range(k):
+      spectrum[(k, "-", (shift - frame) % k)] = reverse_frames[frame]
+
+  return spectrum
+
+def count_frames(spectrum, k, strand, codes, frames):
+  """
+    This function adds k-mer codes to the count tables of their reading frames.
+
+    @param spectrum {dict}: the counts, as built by kmer_spectrum, updated in place
+    @param k {int}: the k-mer size
+    @param strand {str}: "+" or "-"
+    @param codes {np.ndarray}: the k-mer codes to be counted
+    @param frames {np.ndarray}: the frame of each code
+  """
+
+  for frame in range(k):
+    frame_codes = codes[frames == frame]
+    table = spectrum[(k, strand, frame)]
+
+    if k <= DENSE_LIMIT:
+      table += np.bincount(frame_codes, minlength=4 ** k)
+    else:
+      values, counts = np.unique(frame_codes, return_counts=True)
+      for code, count in zip(values.tolist(), counts.tolist()):
+        table[code] = table.get(code, 0) + count
+
+def decode_kmer(code, k):
+  """
+    This function converts a k-mer code back into its string of bases.
+
+    @param code {int}: the 2-bit per base k-mer code
+    @param k {int}: the k-mer size
+    @returns {str}: the k-mer
+  """
+
+  return "".join("ACGT"[(code >> (2 * (k - 1 - i))) & 3] for i in range(k))
+
+def output_spectrum(spectrum, output_path):
+  """
+    This function writes the count table of every k and frame with output_frequencies, to <output_path>_k<k>_<strand><frame>.csv, where strand is "f" (forward) or "r" (reverse complement).
+
+    @param spectrum {dict}: the counts, as built by kmer_spectrum
+    @param output_path {str}: the location to put the output files
+  """
+
+  output_path = output_path.replace(".csv", "")
+
+  for (k, strand, frame), table in spectrum.items():
+    if k <= DENSE_LIMIT:
+      codes = np.flatnonzero(table).tolist()
+      kmer_map = {decode_kmer(code, k): int(table[code]) for code in codes}
+    else:
+      kmer_map = {decode_kmer(code, k): table[code] for code in sorted(table)}
+
+    # output_frequencies needs at least one entry
+    if kmer_map:
+      output_frequencies(kmer_map, f"{output_path}_k{k}_{'f' if strand == '+' else 'r'}{frame}.csv")
+
+if __name__ == "__main__":
+  if len(sys.argv) > 3:
+    main(sys.argv[1], sys.argv[2], [int(k) for k in sys.argv[3].split(",")])
+  else:
+    main(sys.argv[1], sys.argv[2])
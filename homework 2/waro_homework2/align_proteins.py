@@ -1,20 +1,116 @@
-import sys, re
+import sys, re, os
+import heapq
+import numpy as np
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import alignment_cache
 
-def main(seq1_file, seq2_file, matches_file=None):
+# the compressed file readers are shared by every homework (seqio.py, two
+# directories up)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from seqio import open_text
+
+# the memory (bytes) of one cell of the alignment matrix. Only the traceback
+# direction of each cell is stored.
+CELL_BYTES = 1
+
+# traceback direction codes, the way each cell of the alignment matrix was
+# reached
+DIAGONAL, UP, LEFT = 0, 1, 2
+
+# alignments whose matrix would need more memory (bytes) than this are done in
+# linear space with hirschberg instead
+MEMORY_BUDGET = 2 * 1024 ** 3
+
+# the version of each mode's alignments, part of their cache key. Bump a mode's
+# version whenever its output can change (e.g. find_anchors or banded
+# internals), so alignments cached before aren't reused
+ENGINE_VERSIONS = {'needleman_wunsch': 1, 'anchored': 1, 'auto': 2, 'banded': 1}
+
+# gap bits of the direction codes of gotoh, whether the gap from above/the left
+# ending in the cell extends the gap of the cell before it rather than opening
+EXTEND_UP, EXTEND_LEFT = 4, 8
+
+# substitution matrices available by name, in the NCBI text format. Other
+# matrices (e.g. PAM250) can be loaded from a file in the same format.
+MATRICES = {
+    'BLOSUM62': """
+#  BLOSUM62, the default scoring matrix of blastp
+   A  R  N  D  C  Q  E  G  H  I  L  K  M  F  P  S  T  W  Y  V  B  Z  X  *
+A  4 -1 -2 -2  0 -1 -1  0 -2 -1 -1 -1 -1 -2 -1  1  0 -3 -2  0 -2 -1  0 -4
+R -1  5  0 -2 -3  1  0 -2  0 -3 -2  2 -1 -3 -2 -1 -1 -3 -2 -3 -1  0 -1 -4
+N -2  0  6  1 -3  0  0  0  1 -3 -3  0 -2 -3 -2  1  0 -4 -2 -3  3  0 -1 -4
+D -2 -2  1  6 -3  0  2 -1 -1 -3 -4 -1 -3 -3 -1  0 -1 -4 -3 -3  4  1 -1 -4
+C  0 -3 -3 -3  9 -3 -4 -3 -3 -1 -1 -3 -1 -2 -3 -1 -1 -2 -2 -1 -3 -3 -2 -4
+Q -1  1  0  0 -3  5  2 -2  0 -3 -2  1  0 -3 -1  0 -1 -2 -1 -2  0  3 -1 -4
+E -1  0  0  2 -4  2  5 -2  0 -3 -3  1 -2 -3 -1  0 -1 -3 -2 -2  1  4 -1 -4
+G  0 -2  0 -1 -3 -2 -2  6 -2 -4 -4 -2 -3 -3 -2  0 -2 -2 -3 -3 -1 -2 -1 -4
+H -2  0  1 -1 -3  0  0 -2  8 -3 -3 -1 -2 -1 -2 -1 -2 -2  2 -3  0  0 -1 -4
+I -1 -3 -3 -3 -1 -3 -3 -4 -3  4  2 -3  1  0 -3 -2 -1 -3 -1  3 -3 -3 -1 -4
+L -1 -2 -3 -4 -1 -2 -3 -4 -3  2  4 -2  2  0 -3 -2 -1 -2 -1  1 -4 -3 -1 -4
+K -1  2  0 -1 -3  1  1 -2 -1 -3 -2  5 -1 -3 -1  0 -1 -3 -2 -2  0  1 -1 -4
+M -1 -1 -2 -3 -1  0 -2 -3 -2  1  2 -1  5  0 -2 -1 -1 -1 -1  1 -3 -1 -1 -4
+F -2 -3 -3 -3 -2 -3 -3 -3 -1  0  0 -3  0  6 -4 -2 -2  1  3 -1 -3 -3 -1 -4
+P -1 -2 -2 -1 -3 -1 -1 -2 -2 -3 -3 -1 -2 -4  7 -1 -1 -4 -3 -2 -2 -1 -2 -4
+S  1 -1  1  0 -1  0  0  0 -1 -2 -2  0 -1 -2 -1  4  1 -3 -2 -2  0  0  0 -4
+T  0 -1  0 -1 -1 -1 -1 -2 -2 -1 -1 -1 -1 -2 -1  1  5 -2 -2  0 -1 -1  0 -4
+W -3 -3 -4 -4 -2 -2 -3 -2 -2 -3 -2 -3 -1  1 -4 -3 -2 11  2 -3 -4 -3 -2 -4
+Y -2 -2 -2 -3 -2 -1 -2 -3  2 -1 -1 -2 -1  3 -3 -2 -2  2  7 -1 -3 -2 -1 -4
+V  0 -3 -3 -3 -1 -2 -2 -3 -3  3  1 -2  1 -1 -2 -2  0 -3 -1  4 -3 -2 -1 -4
+B -2 -1  3  4 -3  0  1 -1  0 -3 -4  0 -3 -3 -2  0 -1 -4 -3 -3  4  1 -1 -4
+Z -1  0  0  1 -3  3  4 -2  0 -3 -3  1 -1 -3 -1  0 -1 -3 -2 -2  1  4 -1 -4
+X  0 -1 -1 -1 -2 -1 -1 -1 -1 -1 -1 -1 -1 -1 -2  0  0 -2 -1 -1 -1 -1 -1 -4
+* -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4  1
+""",
+}
+
+def main(seq1_file, seq2_file, matches_file=None, cache_dir=alignment_cache.CACHE_DIR):
     """
     Description:
         This function is responsible for orchestrator the flow of the program.
+        Alignments are cached in cache_dir, so aligning the same sequences the
+        same way again skips the alignment.
 
     Parameters:
         - seq1_file (str): file path of first sequence file
         - seq2_file (str): file path of second sequence file
         - matches_file (str)(optional): the file containing where sequences 1 &
-            2 are known to align. Default to None.
+            2 are known to align, 'auto' to discover the anchors with
+            find_anchors, 'banded' to align only near the diagonal with
+            banded, or 'database' to align seq1 with every record of
+            seq2_file with database. Default to None.
+        - cache_dir (str)(optional): the alignment cache directory. None to
+            not use the cache. Default to alignment_cache.CACHE_DIR.
     """
     seq1 = open_file(seq1_file)
+
+    if matches_file == 'database':
+        # seq2_file holds many targets, the results are streamed to stdout
+        database(seq1, seq2_file)
+        return
+
     seq2 = open_file(seq2_file)
 
-    if matches_file is None:
+    # the result depends on the scoring, the mode (and its version), and the
+    # anchors
+    anchors_file = matches_file if matches_file not in (None, 'auto', 'banded') else None
+    mode = 'anchored' if anchors_file else matches_file or 'needleman_wunsch'
+    parameters = f'match=1 mismatch=-3 gap=-2 mode={mode} version={ENGINE_VERSIONS[mode]}'
+    key = alignment_cache.cache_key(seq1, seq2, parameters, anchors_file)
+
+    cached = alignment_cache.lookup(key, cache_dir) if cache_dir is not None else None
+
+    if cached is not None:
+        # aligned before, nothing to compute
+        score, aligned1, aligned2 = cached
+    elif matches_file == 'auto':
+        # no matches file, but find where sequences 1 & 2 align and anchor
+        # those sections
+        score, aligned1, aligned2 = anchored(seq1, seq2, None)
+    elif matches_file == 'banded':
+        # closely related sequences, only fill the matrix near the diagonal
+        score, aligned1, aligned2 = needleman_wunsch(seq1, seq2, engine='banded')
+    elif matches_file is None:
         # no matches file included with input. Just run needleman-wunsch on all
         # of sequences 1 and 2
         score, aligned1, aligned2 = needleman_wunsch(seq1, seq2)
@@ -23,19 +119,32 @@ def main(seq1_file, seq2_file, matches_file=None):
         # sections of the sequences
         score, aligned1, aligned2 = anchored(seq1, seq2, matches_file)
 
+    if cached is None and cache_dir is not None:
+        alignment_cache.store(key, score, aligned1, aligned2, cache_dir)
+
     print(f"Score: {score}")
     save_file(score, aligned1, aligned2, seq1_file, seq2_file) # save file to output.txt
     print(f"Aligned sequences saved to output.txt")
 
-def needleman_wunsch(seq1, seq2):
+def needleman_wunsch(seq1, seq2, memory_budget=MEMORY_BUDGET, engine='numpy'):
     """
     Description:
         This function is responsible for performing the needleman-wunsch
-        alignment algorithm on the two input sequences.
+        alignment algorithm on the two input sequences. When the traceback
+        matrix would need more than memory_budget bytes, the alignment is done
+        in linear space with hirschberg instead.
 
     Parameters:
         - seq1 (str): sequence 1 of 2 to be aligned
         - seq2 (str): sequence 2 of 2 to be aligned
+        - memory_budget (int)(optional): the most memory (bytes) the traceback
+            matrix may use. None for no limit. Default to MEMORY_BUDGET.
+        - engine (str)(optional): 'numpy' fills the matrix one anti-diagonal at
+            a time with wavefront_fill, 'python' fills it cell by cell with
+            fill_directions. Both give identical scores and alignments.
+            'banded' only fills a band around the diagonal with banded, giving
+            the same score (and possibly another optimal alignment). Default
+            to 'numpy'.
 
     Returns tuple(score, aligned1, aligned2):
         - score (int): the alignment score of aligning seq1 and seq2
@@ -44,29 +153,295 @@ def needleman_wunsch(seq1, seq2):
     """
     width = len(seq1) # width of the matrix
     height = len(seq2) # height of the matrix
-    matrix = initialize_matrix(width, height) # matrix containing alignment scores
+
+    if engine == 'banded':
+        return banded(seq1, seq2, memory_budget=memory_budget)
+
+    if memory_budget is not None and (width + 1) * (height + 1) * CELL_BYTES > memory_budget:
+        return hirschberg(seq1, seq2, memory_budget, engine)
+
+    # populate the matrix, keeping only the direction each cell came from
+    if engine == 'numpy':
+        score, directions = wavefront_fill(seq1, seq2)
+    else:
+        score, directions = fill_directions(seq1, seq2)
+
+    # move back through the matrix, aligning the sequences
+    aligned1, aligned2 = traceback(directions, seq1, seq2)
+
+    return (score, aligned1, aligned2)
+
+def fill_directions(seq1, seq2):
+    """
+    Description:
+        This function fills the needleman-wunsch alignment matrix cell by cell.
+        Only two rows of scores are kept, while the direction each cell came
+        from is recorded in a bytearray (one DIAGONAL/UP/LEFT code per cell),
+        breaking ties the same way as align_sequences.
+
+    Parameters:
+        - seq1 (str): sequence 1 of 2 to be aligned (the columns)
+        - seq2 (str): sequence 2 of 2 to be aligned (the rows)
+
+    Returns tuple(score, directions):
+        - score (int): the alignment score of aligning seq1 and seq2
+        - directions (bytearray): the direction code of each cell, row by row
+    """
+    width = len(seq1) # width of the matrix
+    height = len(seq2) # height of the matrix
     gap = -2 # gap penalty
     # ignore the affine/linar gap penalty. i.e. all gaps are worth -2
 
-    # populate the matrix
+    # the first row comes from the left, the first column from above
+    directions = bytearray(width + 1)
+    directions[1:] = bytes([LEFT]) * width
+    previous = [gap * col for col in range(width + 1)]
+
     for row in range(1, height + 1):
+        current = [gap * row] + [0] * width
+        row_directions = bytearray(width + 1) # defaults to DIAGONAL
+        row_directions[0] = UP
+        base = seq2[row - 1]
+
         for col in range(1, width + 1):
             # diagonally, will it be a match(+1) or a mismatch(-3)
-            match = 1 if seq1[col - 1] == seq2[row - 1] else -3
+            match = 1 if seq1[col - 1] == base else -3
+
+            up = previous[col] + gap
+            left = current[col-1] + gap
 
             # assign the max of diagonal, or gaps from above/left to next cell
-            matrix[row][col] = max(
-                matrix[row-1][col] + gap,
-                matrix[row][col-1] + gap,
-                matrix[row-1][col-1] + match
-            )
+            best = max(up, left, previous[col-1] + match)
+            current[col] = best
 
-    score = matrix[height][width] # grab the score from the last cell
+            if best == up:
+                row_directions[col] = UP
+            elif best == left:
+                row_directions[col] = LEFT
 
-    # move back through the matrix, aligning the sequences
-    aligned1, aligned2 = align_sequences(matrix, seq1, seq2)
+        directions += row_directions
+        previous = current
 
-    return (score, aligned1, aligned2)
+    return (previous[width], directions)
+
+def encode_sequence(seq):
+    """
+    Description:
+        This function integer-encodes a sequence, one code point per character,
+        so characters can be compared with numpy.
+
+    Parameters:
+        - seq (str): the sequence to be encoded
+
+    Returns:
+        - (np.ndarray): the uint32 code of each character of seq
+    """
+    return np.frombuffer(seq.encode('utf-32-le'), dtype=np.uint32)
+
+def wavefront_fill(seq1, seq2):
+    """
+    Description:
+        This function fills the needleman-wunsch alignment matrix one
+        anti-diagonal at a time. Every cell of an anti-diagonal only depends on
+        the two previous anti-diagonals, so each one is computed as a single
+        numpy operation and only three anti-diagonals of scores are kept. The
+        direction each cell came from is recorded in a uint8 matrix, giving the
+        same directions as fill_directions.
+
+    Parameters:
+        - seq1 (str): sequence 1 of 2 to be aligned (the columns)
+        - seq2 (str): sequence 2 of 2 to be aligned (the rows)
+
+    Returns tuple(score, directions):
+        - score (int): the alignment score of aligning seq1 and seq2
+        - directions (np.ndarray): the direction code of each cell, row by row
+    """
+    width = len(seq1) # width of the matrix
+    height = len(seq2) # height of the matrix
+    gap = -2 # gap penalty
+
+    # seq1 is reversed so the seq1 characters along an anti-diagonal are a
+    # contiguous slice
+    codes1 = encode_sequence(seq1)[::-1]
+    codes2 = encode_sequence(seq2)
+
+    # the first row comes from the left, the first column from above
+    directions = np.full((height + 1) * (width + 1), DIAGONAL, dtype=np.uint8)
+    directions[1:width+1] = LEFT
+    directions[width+1::width+1] = UP
+
+    # the anti-diagonal before the previous one, the previous one, and the one
+    # being filled, indexed by row. The buffers are rotated instead of
+    # reallocated, and so are the scratch buffers below.
+    before = np.zeros(height + 1, dtype=np.int32)
+    previous = np.full(height + 1, gap, dtype=np.int32)
+    current = np.zeros(height + 1, dtype=np.int32)
+    gap_buffer = np.empty(height + 1, dtype=np.int32)
+    diagonal_buffer = np.empty(height, dtype=np.int32)
+    left_buffer = np.empty(height, dtype=bool)
+    up_buffer = np.empty(height, dtype=bool)
+    step_buffer = np.empty(height, dtype=np.uint8)
+
+    for diagonal in range(2, width + height + 1):
+        if diagonal <= width: current[0] = gap * diagonal
+        if diagonal <= height: current[diagonal] = gap * diagonal
+
+        # rows of the inner cells on this anti-diagonal (col = diagonal - row)
+        low, high = max(1, diagonal - width), min(height, diagonal - 1)
+
+        if low <= high:
+            size = high - low + 1
+            cells = current[low:high+1]
+            from_diagonal = diagonal_buffer[:size]
+            is_left, is_up, step = left_buffer[:size], up_buffer[:size], step_buffer[:size]
+
+            # diagonally, will it be a match(+1) or a mismatch(-3)
+            np.equal(codes2[low-1:high], codes1[width-diagonal+low:width-diagonal+high+1], out=is_left)
+            np.multiply(is_left, 4, out=from_diagonal)
+            from_diagonal += before[low-1:high]
+            from_diagonal -= 3
+
+            # gaps from above are the previous anti-diagonal shifted by one row
+            with_gap = gap_buffer[:size+1]
+            np.add(previous[low-1:high+1], gap, out=with_gap)
+            from_above, from_left = with_gap[:-1], with_gap[1:]
+
+            # assign the max of diagonal, or gaps from above/left to next cell
+            np.maximum(from_above, from_left, out=cells)
+            np.maximum(cells, from_diagonal, out=cells)
+
+            # above wins ties, then left, then diagonal
+            np.equal(cells, from_above, out=is_up)
+            np.equal(cells, from_left, out=is_left)
+            np.greater(is_left, is_up, out=is_left)
+            np.left_shift(is_left.view(np.uint8), 1, out=step) # LEFT
+            np.bitwise_or(step, is_up.view(np.uint8), out=step) # UP
+
+            # cell (row, diagonal - row) sits at row * width + diagonal
+            directions[low*width+diagonal:high*width+diagonal+1:width] = step
+
+        before, previous, current = previous, current, before
+
+    # the last cell is on the final anti-diagonal, unless seq1 or seq2 is empty
+    score = int(previous[height]) if width and height else gap * (width + height)
+
+    return (score, directions)
+
+def score_batch(seqs1, seq2):
+    """
+    Description:
+        This function computes only the needleman-wunsch alignment scores of a
+        batch of equal length sequences against seq2, without any traceback.
+        The batch is an extra numpy axis of the anti-diagonal wavefront, so
+        every sequence is scored by the same numpy operations, and only three
+        anti-diagonals of scores are kept per sequence.
+
+    Parameters:
+        - seqs1 (list(str)): the sequences to be aligned with seq2, all of the
+            same length (e.g. shuffles of one sequence)
+        - seq2 (str): the sequence every member of seqs1 is aligned with
+
+    Returns:
+        - (list(int)): the alignment score of each sequence of seqs1 with seq2
+    """
+    width = len(seqs1[0]) if seqs1 else 0 # width of each matrix
+    height = len(seq2) # height of each matrix
+    gap = -2 # gap penalty
+
+    if not width or not height:
+        return [gap * (width + height)] * len(seqs1)
+
+    # each row of codes1 is a reversed seq1, so its characters along an
+    # anti-diagonal are a contiguous slice
+    codes1 = np.array([encode_sequence(seq) for seq in seqs1])[:, ::-1]
+    codes2 = encode_sequence(seq2)
+
+    # the anti-diagonal before the previous one, the previous one, and the one
+    # being filled, one row per sequence of the batch
+    shape = (len(seqs1), height + 1)
+    before = np.zeros(shape, dtype=np.int32)
+    previous = np.full(shape, gap, dtype=np.int32)
+    current = np.zeros(shape, dtype=np.int32)
+
+    for diagonal in range(2, width + height + 1):
+        if diagonal <= width: current[:, 0] = gap * diagonal
+        if diagonal <= height: current[:, diagonal] = gap * diagonal
+
+        # rows of the inner cells on this anti-diagonal (col = diagonal - row)
+        low, high = max(1, diagonal - width), min(height, diagonal - 1)
+
+        if low <= high:
+            # diagonally, will it be a match(+1) or a mismatch(-3)
+            same = codes1[:, width-diagonal+low:width-diagonal+high+1] == codes2[low-1:high]
+            from_diagonal = before[:, low-1:high] + np.where(same, 1, -3)
+
+            # assign the max of diagonal, or gaps from above/left to next cell
+            cells = current[:, low:high+1]
+            np.maximum(previous[:, low-1:high], previous[:, low:high+1], out=cells)
+            cells += gap
+            np.maximum(cells, from_diagonal, out=cells)
+
+        before, previous, current = previous, current, before
+
+    return previous[:, height].tolist()
+
+def traceback(directions, seq1, seq2, band=None):
+    """
+    Description:
+        This function follows the recorded directions back from the last cell
+        (bottom-right) to the starting cell, giving the optimal alignment
+        between seq1 and seq2. Characters are collected into lists which are
+        reversed once at the end.
+
+    Parameters:
+        - directions (bytearray or np.ndarray): the direction code of each cell
+            of the alignment matrix, row by row
+        - seq1 (str): sequence 1 of 2 being aligned
+        - seq2 (str): sequence 2 of 2 being aligned
+        - band (tuple(int, int))(optional): the (lowest, highest) diagonal
+            (col - row) of a banded matrix from banded_fill. Default to None,
+            a full matrix.
+
+    Returns tuple(aligned1, aligned2):
+        - aligned1 (str): seq1 adjusted to be aligned with seq2
+        - aligned2 (str): seq2 adjusted to be aligned with seq1
+    """
+    aligned1, aligned2 = [], []
+    directions = memoryview(directions) # fast single byte lookups
+
+    # cell (row, col) sits at row * stride + col + offset. A banded row holds
+    # its diagonals lowest to highest, starting at col = row + lowest
+    if band is None:
+        stride, offset = len(seq1) + 1, 0
+    else:
+        stride, offset = band[1] - band[0], -band[0]
+
+    # start from last row and column
+    row, col = len(seq2), len(seq1)
+
+    while row > 0 or col > 0:
+        step = directions[row * stride + col + offset]
+
+        # we came from above, add gap to seq1
+        if step == UP:
+            aligned1.append('-')
+            aligned2.append(seq2[row-1])
+            row -= 1
+
+        # we came from the left, add gap to seq2
+        elif step == LEFT:
+            aligned1.append(seq1[col-1])
+            aligned2.append('-')
+            col -= 1
+
+        # we came from diagonal
+        else:
+            aligned1.append(seq1[col-1])
+            aligned2.append(seq2[row-1])
+            row -= 1
+            col -= 1
+
+    return (''.join(reversed(aligned1)), ''.join(reversed(aligned2)))
 
 def align_sequences(matrix, seq1, seq2):
     """
@@ -85,8 +460,7 @@ def align_sequences(matrix, seq1, seq2):
         - aligned1 (str): seq1 adjusted to be aligned with seq2
         - aligned2 (str): seq2 adjusted to be aligned with seq1
     """
-    aligned1 = ""
-    aligned2 = ""
+    aligned1, aligned2 = [], []
 
     # start from last row and column
     row = len(matrix) - 1
@@ -100,77 +474,826 @@ def align_sequences(matrix, seq1, seq2):
 
         # we came from above, add gap to seq1
         if row > 0 and current == matrix[row-1][col] - 2:
-            aligned1 = '-' + aligned1
-            aligned2 = seq2[row-1] + aligned2
+            aligned1.append('-')
+            aligned2.append(seq2[row-1])
             row -= 1
 
         # we came from the left, add gap to seq2
         elif col > 0 and current == matrix[row][col-1] - 2:
-            aligned1 = seq1[col-1] + aligned1
-            aligned2 = '-' + aligned2
+            aligned1.append(seq1[col-1])
+            aligned2.append('-')
             col -= 1
 
         # we came from diagonal
         else:
-            aligned1 = seq1[col-1] + aligned1
-            aligned2 = seq2[row-1] + aligned2
+            aligned1.append(seq1[col-1])
+            aligned2.append(seq2[row-1])
             row -= 1
             col -= 1
 
-    return (aligned1, aligned2)
+    # the characters were collected backwards
+    return (''.join(reversed(aligned1)), ''.join(reversed(aligned2)))
 
-def anchored(seq1, seq2, matches_file):
+def hirschberg(seq1, seq2, memory_budget=MEMORY_BUDGET, engine='numpy'):
     """
     Description:
-        This function is responsible for performing the anchored alignment of
-        seq1 and seq2.
+        This function performs the needleman-wunsch alignment in linear space,
+        using hirschberg's divide and conquer. seq2 is split in half, and the
+        column seq1 should be split at is the one maximizing the score of
+        aligning the top half forwards plus the bottom half backwards. Both
+        halves are then aligned recursively, until they fit in memory_budget.
+        The score is the optimal needleman-wunsch score, and the alignment is
+        an optimal one (ties may be broken differently than align_sequences).
 
     Parameters:
         - seq1 (str): sequence 1 of 2 to be aligned
         - seq2 (str): sequence 2 of 2 to be aligned
-        - matches_file (str): the file path for the matches file containing
-            where seq1 and seq2 are known to align.
+        - memory_budget (int)(optional): the most memory (bytes) the alignment
+            matrix of a sub-problem may use. Default to MEMORY_BUDGET.
+        - engine (str)(optional): the needleman_wunsch engine used for the
+            sub-problems. Default to 'numpy'.
 
     Returns tuple(score, aligned1, aligned2):
         - score (int): the alignment score of aligning seq1 and seq2
         - aligned1 (str): seq1 adjusted to be aligned with seq2
         - aligned2 (str): seq2 adjusted to be aligned with seq1
     """
-    # extract anchored locations for the different CoV proteins
-    cov1, cov2 = open_matches_file(matches_file)
+    # small enough to align with the full matrix
+    cells = (len(seq1) + 1) * (len(seq2) + 1)
+    if len(seq1) <= 1 or len(seq2) <= 1 or cells * CELL_BYTES <= memory_budget:
+        return needleman_wunsch(seq1, seq2, None, engine)
 
-    aligned1, aligned2 = "", ""
+    mid = len(seq2) // 2
 
-    # align up to the first anchored alignments
-    score, aligned1, aligned2 = needleman_wunsch(seq1[0:cov1[0][0]-1], seq2[0:cov2[0][0]-1])
+    # scores of aligning the top half of seq2 with every prefix of seq1, and
+    # the bottom half of seq2 with every suffix of seq1
+    top = last_row(seq1, seq2[:mid], engine)
+    bottom = last_row(seq1[::-1], seq2[mid:][::-1], engine)
 
-    # iterate over the anchored alignments, first simply adding the anchored
-    # alignment sections, and then performing needleman-wunsch for the sections
-    # between achored sections.
-    for i in range(len(cov1)):
-        # add anchored alignment areas
-        aligned1 += seq1[cov1[i][0]-1:cov1[i][1]]
-        aligned2 += seq2[cov2[i][0]-1:cov2[i][1]]
+    width = len(seq1)
+    split = max(range(width + 1), key=lambda col: top[col] + bottom[width - col])
 
-        if i < len(cov1) - 1:
-            # if there are more anchored sections, perform needleman-wunsch
-            # between this anchored section and the next one.
-            score, a1, a2 = needleman_wunsch(seq1[cov1[i][1]:cov1[i+1][0]-1], seq2[cov2[i][1]:cov2[i+1][0]-1])
+    score1, top1, top2 = hirschberg(seq1[:split], seq2[:mid], memory_budget, engine)
+    score2, bottom1, bottom2 = hirschberg(seq1[split:], seq2[mid:], memory_budget, engine)
+
+    return (score1 + score2, top1 + bottom1, top2 + bottom2)
+
+def last_row(seq1, seq2, engine='numpy'):
+    """
+    Description:
+        This function computes the last row of the needleman-wunsch alignment
+        matrix of seq1 and seq2, keeping only two rows in memory. The numpy
+        engine fills each row with a few numpy operations: pairs and gaps from
+        above only need the previous row, and the best run of gaps from the
+        left is a running maximum (maximum.accumulate) of the row's scores
+        minus the gap scores leading up to each column.
+
+    Parameters:
+        - seq1 (str): sequence 1 of 2 to be aligned (the columns)
+        - seq2 (str): sequence 2 of 2 to be aligned (the rows)
+        - engine (str)(optional): 'python' fills the rows cell by cell, any
+            other engine with numpy. Default to 'numpy'.
+
+    Returns:
+        - previous (list): the alignment score of seq2 with each prefix of seq1
+    """
+    gap = -2 # gap penalty
+
+    if engine != 'python':
+        codes1 = encode_sequence(seq1)
+        codes2 = encode_sequence(seq2)
+
+        # the gap scores from the first column to each column
+        offsets = np.arange(len(seq1) + 1, dtype=np.int32) * gap
+        previous = offsets.copy()
+        diagonal = np.empty(len(seq1) + 1, dtype=np.int32)
+        diagonal[0] = np.iinfo(np.int32).min // 2
+
+        for row in range(1, len(seq2) + 1):
+            # diagonally, will it be a match(+1) or a mismatch(-3)
+            np.add(previous[:-1], np.where(codes1 == codes2[row - 1], 1, -3), out=diagonal[1:])
+
+            # current[col] = max over start <= col of (max(above, diagonal)[start] + the gaps from start to col)
+            rest = np.maximum(previous + gap, diagonal)
+            previous = np.maximum.accumulate(rest - offsets) + offsets
+
+        return previous.tolist()
+
+    previous = [gap * col for col in range(len(seq1) + 1)]
+
+    for row in range(1, len(seq2) + 1):
+        current = [gap * row] + [0] * len(seq1)
+        base = seq2[row - 1]
+
+        for col in range(1, len(seq1) + 1):
+            # diagonally, will it be a match(+1) or a mismatch(-3)
+            match = 1 if seq1[col - 1] == base else -3
+
+            current[col] = max(
+                previous[col] + gap,
+                current[col-1] + gap,
+                previous[col-1] + match
+            )
+
+        previous = current
+
+    return previous
+
+def banded(seq1, seq2, band=32, memory_budget=MEMORY_BUDGET):
+    """
+    Description:
+        This function performs the needleman-wunsch alignment only within a
+        band of diagonals (col - row) around the ones joining the first and
+        last cells, which is enough for closely related sequences and costs
+        O(len(seq2) * band) instead of O(len(seq1) * len(seq2)).
+
+        banded_fill also bounds the score of every path leaving the band, from
+        the best score of reaching each edge cell plus the best conceivable
+        score of the rest of the path. The banded alignment is accepted once
+        its path stays off the band edges and its score is at least that
+        bound, which proves it optimal. Otherwise the band is (at least)
+        doubled and the alignment redone, falling back to the full matrix once the band would
+        cover it.
+
+    Parameters:
+        - seq1 (str): sequence 1 of 2 to be aligned
+        - seq2 (str): sequence 2 of 2 to be aligned
+        - band (int)(optional): the first number of extra diagonals on each
+            side. Default to 32.
+        - memory_budget (int)(optional): the most memory (bytes) the traceback
+            matrix may use, see needleman_wunsch. Default to MEMORY_BUDGET.
+
+    Returns tuple(score, aligned1, aligned2):
+        - score (int): the alignment score of aligning seq1 and seq2
+        - aligned1 (str): seq1 adjusted to be aligned with seq2
+        - aligned2 (str): seq2 adjusted to be aligned with seq1
+    """
+    width = len(seq1) # width of the matrix
+    height = len(seq2) # height of the matrix
+
+    while True:
+        # the diagonals of the first and last cells, plus band on each side
+        lowest = min(0, width - height) - band
+        highest = max(0, width - height) + band
+
+        # the band is no smaller than the matrix
+        if highest - lowest >= width or (memory_budget is not None and (height + 1) * (highest - lowest + 1) * CELL_BYTES > memory_budget):
+            return needleman_wunsch(seq1, seq2, memory_budget)
+
+        score, directions, leaving = banded_fill(seq1, seq2, lowest, highest)
+        aligned1, aligned2 = traceback(directions, seq1, seq2, (lowest, highest))
+
+        # the diagonal after every column of the alignment
+        steps = (np.frombuffer(aligned1.encode('utf-32-le'), dtype=np.uint32) != ord('-')).astype(np.int64)
+        steps -= np.frombuffer(aligned2.encode('utf-32-le'), dtype=np.uint32) != ord('-')
+        path = np.cumsum(steps)
+
+        # band edges that aren't also edges of the matrix
+        touched = len(path) and ((highest < width and path.max() >= highest) or (lowest > -height and path.min() <= lowest))
+
+        if not touched and score >= leaving:
+            return (score, aligned1, aligned2)
+
+        # paths leaving the band from the first row or column bound it at
+        # 3 * max(width, height) - 2 * min(width, height) - 5 * (band + 1 +
+        # abs(width - height)), so skip bands too narrow to ever be proven
+        band = max(2 * band, (3 * max(width, height) - 2 * min(width, height) - score) // 5 - abs(width - height))
+
+def banded_fill(seq1, seq2, lowest, highest):
+    """
+    Description:
+        This function fills the needleman-wunsch alignment matrix one
+        anti-diagonal at a time like wavefront_fill, but only the cells whose
+        diagonal (col - row) is between lowest and highest. Cells outside the
+        band are treated as unreachable. Each row of the direction matrix only
+        stores its band, so cell (row, col) sits at
+        row * (highest - lowest) + col - lowest.
+
+        A path leaving the band first steps off an edge cell, which it reached
+        scoring at most that cell's banded score. With r rows and c columns
+        left after the step, the rest of the path scores at most
+        min(r, c) - 2 * abs(r - c) (all matches and the fewest gaps), so no
+        path leaving the band beats the best of these sums.
+
+    Parameters:
+        - seq1 (str): sequence 1 of 2 to be aligned (the columns)
+        - seq2 (str): sequence 2 of 2 to be aligned (the rows)
+        - lowest (int): the lowest diagonal of the band, at most
+            min(0, len(seq1) - len(seq2))
+        - highest (int): the highest diagonal of the band, at least
+            max(0, len(seq1) - len(seq2)), and at least lowest + 2
+
+    Returns tuple(score, directions, leaving):
+        - score (int): the best alignment score of seq1 and seq2 within the band
+        - directions (np.ndarray): the direction code of each cell of the band,
+            row by row
+        - leaving (int): the most any path leaving the band can score
+    """
+    width = len(seq1) # width of the matrix
+    height = len(seq2) # height of the matrix
+    gap = -2 # gap penalty
+    stride = highest - lowest # flat distance between (row, col) and (row+1, col)
+    unreachable = np.iinfo(np.int32).min // 2 # stays negative with gaps added
+
+    codes1 = encode_sequence(seq1)[::-1]
+    codes2 = encode_sequence(seq2)
+
+    directions = np.full((height + 1) * (stride + 1), DIAGONAL, dtype=np.uint8)
+
+    # the anti-diagonals, indexed by row. The one before the first holds no
+    # cells, and the first holds only the starting cell. The buffers are
+    # rotated instead of reallocated, and so are the scratch buffers below.
+    before = np.full(height + 1, unreachable, dtype=np.int32)
+    previous = np.full(height + 1, unreachable, dtype=np.int32)
+    current = np.full(height + 1, unreachable, dtype=np.int32)
+    previous[0] = 0
+    size = min(height, stride // 2 + 1) + 1 # the most cells on an anti-diagonal
+    gap_buffer = np.empty(size + 1, dtype=np.int32)
+    diagonal_buffer = np.empty(size, dtype=np.int32)
+    left_buffer = np.empty(size, dtype=bool)
+    up_buffer = np.empty(size, dtype=bool)
+    step_buffer = np.empty(size, dtype=np.uint8)
+
+    leaving = unreachable
+
+    for diagonal in range(1, width + height + 1):
+        # rows of the cells on this anti-diagonal within the band and matrix
+        low = max(0, diagonal - width, -((highest - diagonal) // 2))
+        high = min(height, diagonal, (diagonal - lowest) // 2)
+
+        # the first row comes from the left, the first column from above
+        if low == 0:
+            current[0] = gap * diagonal
+            directions[diagonal - lowest] = LEFT
+        if high == diagonal:
+            current[diagonal] = gap * diagonal
+            directions[diagonal * stride - lowest] = UP
+
+        # rows of the inner cells (col = diagonal - row)
+        inner_low, inner_high = max(1, low), min(diagonal - 1, high)
+
+        if inner_low <= inner_high:
+            size = inner_high - inner_low + 1
+            cells = current[inner_low:inner_high+1]
+            from_diagonal = diagonal_buffer[:size]
+            is_left, is_up, step = left_buffer[:size], up_buffer[:size], step_buffer[:size]
+
+            # diagonally, will it be a match(+1) or a mismatch(-3)
+            np.equal(codes2[inner_low-1:inner_high], codes1[width-diagonal+inner_low:width-diagonal+inner_high+1], out=is_left)
+            np.multiply(is_left, 4, out=from_diagonal)
+            from_diagonal += before[inner_low-1:inner_high]
+            from_diagonal -= 3
+
+            # gaps from above are the previous anti-diagonal shifted by one row
+            with_gap = gap_buffer[:size+1]
+            np.add(previous[inner_low-1:inner_high+1], gap, out=with_gap)
+            from_above, from_left = with_gap[:-1], with_gap[1:]
+
+            # assign the max of diagonal, or gaps from above/left to next cell
+            np.maximum(from_above, from_left, out=cells)
+            np.maximum(cells, from_diagonal, out=cells)
+
+            # above wins ties, then left, then diagonal
+            np.equal(cells, from_above, out=is_up)
+            np.equal(cells, from_left, out=is_left)
+            np.greater(is_left, is_up, out=is_left)
+            np.left_shift(is_left.view(np.uint8), 1, out=step) # LEFT
+            np.bitwise_or(step, is_up.view(np.uint8), out=step) # UP
+
+            # cell (row, diagonal - row) sits at row * (stride - 1) + diagonal - lowest
+            start = inner_low * (stride - 1) + diagonal - lowest
+            directions[start:inner_high*(stride-1)+diagonal-lowest+1:stride-1] = step
+
+        # a path can leave the band above from the highest diagonal's cell by
+        # stepping left, and below from the lowest diagonal's cell by stepping
+        # up. The rows and columns left after the step bound the rest of it.
+        row = (diagonal - highest) // 2
+        if (diagonal - highest) % 2 == 0 and low <= row <= high and diagonal - row < width:
+            rows, cols = height - row, width - (diagonal - row) - 1
+            leaving = max(leaving, int(current[row]) + gap + min(rows, cols) - 2 * abs(rows - cols))
+
+        row = (diagonal - lowest) // 2
+        if (diagonal - lowest) % 2 == 0 and low <= row <= high and row < height:
+            rows, cols = height - row - 1, width - (diagonal - row)
+            leaving = max(leaving, int(current[row]) + gap + min(rows, cols) - 2 * abs(rows - cols))
+
+        # the cells just outside the band are read by the next anti-diagonal
+        if low > 0: current[low-1] = unreachable
+        if high < height: current[high+1] = unreachable
+
+        before, previous, current = previous, current, before
+
+    return (int(previous[height]), directions, leaving)
+
+def gotoh(seq1, seq2, matrix='BLOSUM62', gap_open=11, gap_extend=1):
+    """
+    Description:
+        This function performs the global alignment of seq1 and seq2 with a
+        substitution matrix and affine gaps, a gap of length L scoring
+        -(gap_open + (L - 1) * gap_extend). The sequences are integer-encoded
+        once, and the matrix is turned into a profile of seq1 so each row of
+        the alignment matrices looks up its scores with one numpy take. Gotoh's
+        three matrices (ending in a pair, a gap from above, or a gap from the
+        left) are then filled one row at a time with gotoh_fill.
+
+    Parameters:
+        - seq1 (str): sequence 1 of 2 to be aligned
+        - seq2 (str): sequence 2 of 2 to be aligned
+        - matrix (str or tuple)(optional): the name of a matrix in MATRICES, the
+            path of a matrix file, or an (alphabet, scores) pair from
+            load_matrix. Default to 'BLOSUM62'.
+        - gap_open (int)(optional): the penalty of the first position of a gap.
+            Default to 11.
+        - gap_extend (int)(optional): the penalty of every other position of a
+            gap, at most gap_open. Default to 1.
+
+    Returns tuple(score, aligned1, aligned2):
+        - score (int): the alignment score of aligning seq1 and seq2
+        - aligned1 (str): seq1 adjusted to be aligned with seq2
+        - aligned2 (str): seq2 adjusted to be aligned with seq1
+    """
+    if gap_extend > gap_open:
+        raise ValueError('gap_extend should not be more than gap_open')
+
+    alphabet, scores = load_matrix(matrix) if isinstance(matrix, str) else matrix
+
+    codes1 = encode_residues(seq1, alphabet)
+    codes2 = encode_residues(seq2, alphabet)
+
+    # the score of every residue of the alphabet against each residue of seq1
+    profile = scores[:, codes1]
+
+    score, directions = gotoh_fill(profile, codes2, gap_open, gap_extend)
+    aligned1, aligned2 = gotoh_traceback(directions, seq1, seq2)
+
+    return (score, aligned1, aligned2)
+
+def gotoh_fill(profile, codes2, gap_open, gap_extend):
+    """
+    Description:
+        This function fills gotoh's three alignment matrices a row at a time.
+        Pairs and gaps from above only depend on the previous row, so they are
+        single numpy operations. A gap from the left can start at any earlier
+        cell of the row, and its best start is a running maximum (numpy's
+        maximum.accumulate) of the row's other scores plus gap_extend per
+        column. Only two rows of scores are kept. Each cell records the matrix
+        its best score came from (DIAGONAL, UP or LEFT, above winning ties,
+        then left), plus EXTEND_UP and EXTEND_LEFT when its gap from above/the
+        left extends the previous cell's gap.
+
+    Parameters:
+        - profile (np.ndarray): the (alphabet x len(seq1)) scores of every
+            residue against each residue of seq1 (the columns)
+        - codes2 (np.ndarray): the residue codes of seq2 (the rows)
+        - gap_open (int): the penalty of the first position of a gap
+        - gap_extend (int): the penalty of every other position of a gap
+
+    Returns tuple(score, directions):
+        - score (int): the alignment score of the two sequences
+        - directions (np.ndarray): the direction code of each cell, row by row
+    """
+    width = profile.shape[1] # width of the matrix
+    height = len(codes2) # height of the matrix
+    unreachable = np.iinfo(np.int32).min // 2 # stays negative with gaps added
+
+    directions = np.empty((height + 1, width + 1), dtype=np.uint8)
+
+    # gap_extend per column, so a gap from the left between two cells is the
+    # difference of their offsets
+    offsets = np.arange(width + 1, dtype=np.int32) * gap_extend
+
+    # the first row is one gap from the left
+    best = np.empty(width + 1, dtype=np.int32) # best of all three matrices
+    best[0] = 0
+    best[1:] = -gap_open - offsets[:-1]
+    above = np.full(width + 1, unreachable, dtype=np.int32) # ending in a gap from above
+    directions[0] = LEFT | EXTEND_LEFT
+    directions[0, :2] = LEFT
+    directions[0, 0] = DIAGONAL
+
+    pair = np.empty(width + 1, dtype=np.int32)
+    rest = np.empty(width + 1, dtype=np.int32)
+    left = np.empty(width + 1, dtype=np.int32)
+    opened = np.empty(width + 1, dtype=np.int32)
+
+    for row in range(1, height + 1):
+        # the first column is one gap from above
+        first = -gap_open - (row - 1) * gap_extend
+
+        # gaps from above, opened from the previous row's best or extended
+        np.subtract(best, gap_open, out=opened)
+        above -= gap_extend
+        extend_up = above > opened
+        np.maximum(above, opened, out=above)
+        above[0] = first
+
+        # pairs, the previous row's best diagonally plus the profile's scores
+        pair[0] = unreachable
+        np.add(best[:-1], profile[codes2[row-1]], out=pair[1:])
+
+        # gaps from the left start from the best of a pair or a gap from above
+        # at an earlier column: left[col] = max(rest[start] + offsets[start])
+        # - gap_open - offsets[col - 1]. Starting from a gap from the left is
+        # never better than extending it.
+        np.maximum(pair, above, out=rest)
+        np.add(rest, offsets, out=left)
+        np.maximum.accumulate(left, out=left)
+        left[1:] = left[:-1] - gap_open - offsets[:-1]
+        left[0] = unreachable
+
+        # above wins ties, then left, then diagonal
+        np.maximum(rest, left, out=best)
+        is_up = best == above
+        is_left = (best == left) & ~is_up
+        step = (is_left.view(np.uint8) << 1) | is_up.view(np.uint8)
+        step |= extend_up.view(np.uint8) << 2
+
+        # the gap from the left extends when the previous cell's gap scores
+        # more than opening from its best
+        extend_left = left[1:-1] - gap_extend > best[1:-1] - gap_open
+        step[2:] |= extend_left.view(np.uint8) << 3
+
+        step[0] = UP | (EXTEND_UP if row > 1 else 0)
+        directions[row] = step
+
+    return (int(best[width]), directions)
+
+def gotoh_traceback(directions, seq1, seq2):
+    """
+    Description:
+        This function follows the directions recorded by gotoh_fill back from
+        the last cell, switching between the three matrices: a pair moves
+        diagonally, and a gap keeps moving up/left for as long as it was
+        extended.
+
+    Parameters:
+        - directions (np.ndarray): the direction code of each cell of the
+            alignment matrices, from gotoh_fill
+        - seq1 (str): sequence 1 of 2 being aligned
+        - seq2 (str): sequence 2 of 2 being aligned
+
+    Returns tuple(aligned1, aligned2):
+        - aligned1 (str): seq1 adjusted to be aligned with seq2
+        - aligned2 (str): seq2 adjusted to be aligned with seq1
+    """
+    aligned1, aligned2 = [], []
+    directions = memoryview(directions.reshape(-1)) # fast single byte lookups
+
+    # start from last row and column, in whichever matrix scored best
+    width = len(seq1) + 1
+    row, col = len(seq2), len(seq1)
+    state = directions[row * width + col] & 3
+
+    while row > 0 or col > 0:
+        code = directions[row * width + col]
+
+        # in a gap from above, add gap to seq1
+        if state == UP:
+            aligned1.append('-')
+            aligned2.append(seq2[row-1])
+            row -= 1
+            state = UP if code & EXTEND_UP else directions[row * width + col] & 3
+
+        # in a gap from the left, add gap to seq2
+        elif state == LEFT:
+            aligned1.append(seq1[col-1])
+            aligned2.append('-')
+            col -= 1
+            state = LEFT if code & EXTEND_LEFT else directions[row * width + col] & 3
+
+        # a pair, move diagonally
         else:
-            # no more anchored sections. Do needleman-wunsch on the remaining
-            # parts of seq1 and seq2
-            score, a1, a2 = needleman_wunsch(seq1[cov1[i][1]:], seq2[cov2[i][1]:])
+            aligned1.append(seq1[col-1])
+            aligned2.append(seq2[row-1])
+            row -= 1
+            col -= 1
+            state = directions[row * width + col] & 3
+
+    return (''.join(reversed(aligned1)), ''.join(reversed(aligned2)))
+
+def load_matrix(matrix):
+    """
+    Description:
+        This function loads a substitution matrix in the NCBI text format: '#'
+        comment lines, a header line of the residues, then one line per residue
+        holding the residue and its scores against every header residue.
+
+    Parameters:
+        - matrix (str): the name of a matrix in MATRICES, or the file path of a
+            matrix file
+
+    Returns tuple(alphabet, scores):
+        - alphabet (str): the residues of the matrix, in order
+        - scores (np.ndarray): the int32 (alphabet x alphabet) scores
+    """
+    if matrix in MATRICES:
+        lines = MATRICES[matrix].splitlines()
+    else:
+        with open_text(matrix) as file:
+            lines = file.read().splitlines()
+
+    lines = [line.split() for line in lines if line.strip() and not line.startswith('#')]
+    alphabet = ''.join(lines[0])
+
+    scores = np.zeros((len(alphabet), len(alphabet)), dtype=np.int32)
+    for line in lines[1:]:
+        scores[alphabet.index(line[0])] = [int(score) for score in line[1:]]
+
+    return (alphabet, scores)
+
+def encode_residues(seq, alphabet):
+    """
+    Description:
+        This function integer-encodes a sequence as the index of each residue
+        in the matrix alphabet. Lowercase residues are treated as uppercase,
+        and residues missing from the alphabet as its unknown residue 'X'.
+
+    Parameters:
+        - seq (str): the sequence to be encoded
+        - alphabet (str): the residues of the substitution matrix
+
+    Returns:
+        - (np.ndarray): the uint8 code of each residue of seq
+    """
+    if 'X' in alphabet:
+        lookup = np.full(256, alphabet.index('X'), dtype=np.uint8)
+    else:
+        lookup = np.full(256, 255, dtype=np.uint8)
+
+    for index, residue in enumerate(alphabet):
+        lookup[ord(residue.upper())] = index
+        lookup[ord(residue.lower())] = index
+
+    codes = lookup[np.frombuffer(seq.encode('ascii', 'replace'), dtype=np.uint8)]
+    if len(alphabet) < 255 and (codes == 255).any():
+        raise ValueError(f'{seq[int(np.argmax(codes == 255))]} is not in the matrix alphabet')
+
+    return codes
+
+def database(query, targets_file, top=100, k=6, workers=None, output=None):
+    """
+    Description:
+        This function aligns the query with the targets of a multi-record
+        FASTA file. The targets are first ranked by the number of distinct
+        k-mers they share with the query, which only takes a pass over the
+        file keeping the top candidates (targets sharing no k-mer are never
+        candidates). Only those are aligned with needleman_wunsch, over a
+        process pool, and the results are written as tab separated rows
+        (target, score, identity), best score first and ties in record order,
+        so the same query and targets always give the same file.
 
-        # add non-anchored sections
-        aligned1 += a1
-        aligned2 += a2
+    Parameters:
+        - query (str): the sequence aligned with every candidate
+        - targets_file (str): file path of the FASTA file of targets
+        - top (int)(optional): the number of candidates aligned. Default to 100.
+        - k (int)(optional): the k-mer size of the prefilter. Default to 6.
+        - workers (int)(optional): the number of worker processes. Default to
+            None, the number of cpus.
+        - output (file)(optional): where the rows are written. Default to None,
+            stdout.
+    """
+    output = output or sys.stdout
+    query_kmers = {query[i:i+k] for i in range(len(query) - k + 1)}
+
+    # min heap of the best candidates so far, the earliest record winning ties
+    candidates = []
+    for index, (target_id, target) in enumerate(open_records(targets_file)):
+        shared = len(query_kmers.intersection(target[i:i+k] for i in range(len(target) - k + 1)))
+        if shared == 0:
+            continue
+
+        entry = (shared, -index, target_id, target)
+
+        if len(candidates) < top:
+            heapq.heappush(candidates, entry)
+        elif entry > candidates[0]:
+            heapq.heapreplace(candidates, entry)
+
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [(-index, pool.submit(align_target, query, target_id, target)) for shared, index, target_id, target in candidates]
+        results = [(index, *future.result()) for index, future in futures]
+
+    # best score first, then in record order
+    results.sort(key=lambda result: (-result[2], result[0]))
+
+    output.write('target\tscore\tidentity\n')
+    for index, target_id, score, identity in results:
+        output.write(f'{target_id}\t{score}\t{identity:.4f}\n')
+
+def align_target(query, target_id, target):
+    """
+    Description:
+        This function aligns the query with one database target. It is the unit
+        of work handed to each worker process, and only returns the summary of
+        the alignment.
+
+    Parameters:
+        - query (str): sequence 1 of 2 to be aligned
+        - target_id (str): the name of the target
+        - target (str): sequence 2 of 2 to be aligned
 
-    # calculate the score of the alignment
+    Returns tuple(target_id, score, identity):
+        - target_id (str): the name of the target
+        - score (int): the alignment score of the query and target
+        - identity (float): the fraction of the alignment's columns that match
+    """
+    score, aligned1, aligned2 = needleman_wunsch(query, target)
+    matches = sum(a == b for a, b in zip(aligned1, aligned2))
+
+    return (target_id, score, matches / len(aligned1) if aligned1 else 0.0)
+
+def anchored(seq1, seq2, matches_file=None, workers=None):
+    """
+    Description:
+        This function is responsible for performing the anchored alignment of
+        seq1 and seq2. The sections between anchored sections are independent,
+        so they are aligned concurrently over a process pool. The alignment is
+        assembled in order from list buffers, and the score is summed as each
+        section finishes (a needleman-wunsch score is the score of its
+        alignment's columns, so no final rescan is needed).
+
+    Parameters:
+        - seq1 (str): sequence 1 of 2 to be aligned
+        - seq2 (str): sequence 2 of 2 to be aligned
+        - matches_file (str)(optional): the file path for the matches file
+            containing where seq1 and seq2 are known to align. Default to None,
+            discovering the anchors with find_anchors.
+        - workers (int)(optional): the number of worker processes. Default to
+            None, the number of cpus.
+
+    Returns tuple(score, aligned1, aligned2):
+        - score (int): the alignment score of aligning seq1 and seq2
+        - aligned1 (str): seq1 adjusted to be aligned with seq2
+        - aligned2 (str): seq2 adjusted to be aligned with seq1
+    """
+    if matches_file is None:
+        # find anchored locations from shared k-mers
+        cov1, cov2 = find_anchors(seq1, seq2)
+
+        # nothing in common to anchor on
+        if not cov1:
+            return needleman_wunsch(seq1, seq2)
+    else:
+        # extract anchored locations for the different CoV proteins
+        cov1, cov2 = open_matches_file(matches_file)
+
+    # the sections up to the first anchored alignment, between each pair of
+    # anchored alignments, and after the last one
+    sections = [(seq1[0:cov1[0][0]-1], seq2[0:cov2[0][0]-1])]
+    for i in range(len(cov1)):
+        if i < len(cov1) - 1:
+            sections.append((seq1[cov1[i][1]:cov1[i+1][0]-1], seq2[cov2[i][1]:cov2[i+1][0]-1]))
+        else:
+            sections.append((seq1[cov1[i][1]:], seq2[cov2[i][1]:]))
+
+    # even slots hold the aligned sections, odd slots the anchored alignments
+    pieces1 = [None] * (2 * len(cov1) + 1)
+    pieces2 = [None] * (2 * len(cov1) + 1)
     score = 0
-    for i in range(len(aligned1)):
-        aa1 = aligned1[i] # seq1 char at position i
-        aa2 = aligned2[i] # seq2 cahr at position i
 
+    # add anchored alignment areas
+    for i in range(len(cov1)):
+        pieces1[2*i+1] = seq1[cov1[i][0]-1:cov1[i][1]]
+        pieces2[2*i+1] = seq2[cov2[i][0]-1:cov2[i][1]]
+        score += score_alignment(pieces1[2*i+1], pieces2[2*i+1])
+
+    # perform needleman-wunsch on the non-anchored sections
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {pool.submit(needleman_wunsch, *section): 2 * i for i, section in enumerate(sections)}
+
+        for future in as_completed(futures):
+            section_score, a1, a2 = future.result()
+            pieces1[futures[future]] = a1
+            pieces2[futures[future]] = a2
+            score += section_score
+
+    return (score, ''.join(pieces1), ''.join(pieces2))
+
+def find_anchors(seq1, seq2, k=12, max_repeats=8):
+    """
+    Description:
+        This function discovers anchored alignments between seq1 and seq2. A
+        k-mer index of seq1 gives the exact seed hits of every k-mer of seq2,
+        hits on the same diagonal are merged into longer seeds, and the
+        heaviest chain of collinear, non-overlapping seeds is found by dynamic
+        programming. The chained seeds are the anchors.
+
+    Parameters:
+        - seq1 (str): sequence 1 of 2 to be aligned
+        - seq2 (str): sequence 2 of 2 to be aligned
+        - k (int)(optional): the seed length. Default to 12.
+        - max_repeats (int)(optional): k-mers found more often than this in
+            seq1 are too repetitive to anchor on, and are skipped. Default to 8.
+
+    Returns tuple(cov1, cov2):
+        - cov1 (list(list)): list of start and end positions (1-based,
+            inclusive) of the seq1 anchored alignments, like open_matches_file
+        - cov2 (list(list)): list of start and end positions of the seq2
+            anchored alignments
+    """
+    # k-mer index of seq1
+    index = {}
+    for i in range(len(seq1) - k + 1):
+        index.setdefault(seq1[i:i+k], []).append(i)
+
+    # seed hits in seq2, extending the seed already on the same diagonal when
+    # they overlap or touch it. seeds are [start1, start2, length]
+    seeds = []
+    open_seeds = {} # diagonal: the seed currently being extended on it
+    for j in range(len(seq2) - k + 1):
+        hits = index.get(seq2[j:j+k], ())
+        if len(hits) > max_repeats:
+            continue
+
+        for i in hits:
+            seed = open_seeds.get(i - j)
+            if seed is not None and seed[1] + seed[2] >= j:
+                seed[2] = j + k - seed[1]
+            else:
+                open_seeds[i - j] = [i, j, k]
+                seeds.append(open_seeds[i - j])
+
+    chain = chain_seeds(seeds)
+
+    cov1 = [[seed[0] + 1, seed[0] + seed[2]] for seed in chain]
+    cov2 = [[seed[1] + 1, seed[1] + seed[2]] for seed in chain]
+
+    return (cov1, cov2)
+
+def chain_seeds(seeds):
+    """
+    Description:
+        This function finds the chain of seeds with the most total length, where
+        each seed ends before the next one starts in both sequences. Seeds are
+        visited in seq1 order. Once a seed ends before the current one starts
+        in seq1, its best chain score is put in a fenwick tree keyed by its
+        seq2 end, so the best predecessor is a prefix maximum query.
+
+    Parameters:
+        - seeds (list(list)): the [start1, start2, length] of each seed
+
+    Returns:
+        - chain (list(list)): the seeds of the best chain, in order
+    """
+    if not seeds:
+        return []
+
+    # fenwick tree positions of the seq2 end of each seed
+    ends = sorted(set(seed[1] + seed[2] - 1 for seed in seeds))
+    rank = {end: position + 1 for position, end in enumerate(ends)}
+    tree = [(0, -1)] * (len(ends) + 1) # (best chain score, seed)
+
+    by_start = sorted(range(len(seeds)), key=lambda s: seeds[s][0])
+    by_end = sorted(range(len(seeds)), key=lambda s: seeds[s][0] + seeds[s][2] - 1)
+    best = [0] * len(seeds)
+    previous = [-1] * len(seeds)
+    added = 0
+
+    for s in by_start:
+        start1, start2, length = seeds[s]
+
+        # seeds ending before this one starts in seq1 may now precede it
+        while added < len(by_end) and seeds[by_end[added]][0] + seeds[by_end[added]][2] - 1 < start1:
+            t = by_end[added]
+            position = rank[seeds[t][1] + seeds[t][2] - 1]
+            while position < len(tree):
+                tree[position] = max(tree[position], (best[t], t))
+                position += position & -position
+            added += 1
+
+        # the best chain ending before this one starts in seq2
+        position = bisect_left(ends, start2)
+        top = (0, -1)
+        while position > 0:
+            top = max(top, tree[position])
+            position -= position & -position
+
+        best[s] = top[0] + length
+        previous[s] = top[1]
+
+    # follow the best chain back from its last seed
+    chain = []
+    s = max(range(len(seeds)), key=lambda s: best[s])
+    while s != -1:
+        chain.append(seeds[s])
+        s = previous[s]
+
+    return chain[::-1]
+
+def score_alignment(aligned1, aligned2):
+    """
+    Description:
+        This function calculates the score of an alignment column by column.
+
+    Parameters:
+        - aligned1 (str): seq1 adjusted to be aligned with seq2
+        - aligned2 (str): seq2 adjusted to be aligned with seq1
+
+    Returns:
+        - score (int): the alignment score of aligned1 and aligned2
+    """
+    score = 0
+    for aa1, aa2 in zip(aligned1, aligned2):
         if aa1 == '-' or aa2 == '-':
             score -= 2 # gap, -2
         elif aa1 == aa2:
@@ -178,7 +1301,7 @@ def anchored(seq1, seq2, matches_file):
         else:
             score -= 3 # mismatch, -3
 
-    return (score, aligned1, aligned2)
+    return score
 
 def initialize_matrix(width, height):
     """
@@ -224,7 +1347,7 @@ def open_file(file_path):
     protein_str = ""
 
     # open file, and extract the sequence data
-    with open(file_path) as file:
+    with open_text(file_path) as file:
         li = file.readline()
 
         while li:
@@ -240,6 +1363,34 @@ def open_file(file_path):
 
     return protein_str
 
+def open_records(file_path):
+    """
+    Description:
+        This function reads the records of a (multi-record) FASTA file.
+
+    Parameters:
+        - file_path (str): file path of the FASTA file.
+
+    Returns:
+        - (generator(tuple)): the (record id, sequence) of each record, the id
+            being the first word of its '>' header line
+    """
+    record_id, lines = None, []
+
+    with open_text(file_path) as file:
+        for li in file:
+            li = li.strip()
+
+            if li.startswith('>'):
+                if record_id is not None:
+                    yield (record_id, ''.join(lines))
+                record_id, lines = (li[1:].split() or [''])[0], []
+            elif li and record_id is not None:
+                lines.append(li)
+
+    if record_id is not None:
+        yield (record_id, ''.join(lines))
+
 def open_matches_file(matches_file):
     """
     Description:
@@ -302,7 +1453,8 @@ if __name__ == '__main__':
         seq2_file = sys.argv[2] # grab sequence 2
 
         if len(sys.argv) > 3:
-            # matches file included
+            # matches file included, 'auto' to find the anchors, 'banded'
+            # for a banded alignment, or 'database' for a file of targets
             main(seq1_file, seq2_file, sys.argv[3])
         else:
             # matches file not included
@@ -0,0 +1,137 @@
+import hashlib, os, struct, tempfile, zlib
+
+# where the cached alignments are kept between runs, and the most space
+# (bytes) they may use before the least recently used ones are evicted
+CACHE_DIR = '.alignment_cache'
+CACHE_SIZE = 256 * 1024 ** 2
+
+# every entry starts with the magic, the score and the length of aligned1
+HEADER = struct.Struct('<4sqI')
+MAGIC = b'ALN1'
+
+def cache_key(seq1, seq2, parameters, matches_file=None):
+    """
+    Description:
+        This function computes the key of an alignment, a sha256 of everything
+        the result depends on: both sequences, the scoring parameters and the
+        contents of the anchor file (not its name).
+
+    Parameters:
+        - seq1 (str): sequence 1 of 2 being aligned
+        - seq2 (str): sequence 2 of 2 being aligned
+        - parameters (str): the scoring parameters and alignment mode
+        - matches_file (str)(optional): the file path of the anchor file.
+            Default to None.
+
+    Returns:
+        - (str): the hex digest of the key
+    """
+    digest = hashlib.sha256()
+
+    # lengths first, so the fields can't run into each other
+    for field in (seq1, seq2, parameters):
+        data = field.encode()
+        digest.update(struct.pack('<Q', len(data)))
+        digest.update(data)
+
+    if matches_file is not None:
+        with open(matches_file, 'rb') as file:
+            digest.update(file.read())
+
+    return digest.hexdigest()
+
+def lookup(key, cache_dir=CACHE_DIR):
+    """
+    Description:
+        This function reads a cached alignment. A hit refreshes the entry's
+        modification time, which is what eviction orders entries by.
+
+    Parameters:
+        - key (str): the key from cache_key
+        - cache_dir (str)(optional): the cache directory. Default to CACHE_DIR.
+
+    Returns:
+        - (tuple or None): the cached (score, aligned1, aligned2), or None when
+            the alignment isn't cached
+    """
+    path = os.path.join(cache_dir, f'{key}.aln')
+
+    try:
+        with open(path, 'rb') as file:
+            data = file.read()
+        os.utime(path)
+    except OSError:
+        # not cached, or evicted by another run in the meantime
+        return None
+
+    # a damaged entry is a miss, it gets overwritten by the next store
+    try:
+        magic, score, size = HEADER.unpack_from(data)
+        aligned = zlib.decompress(data[HEADER.size:]).decode()
+    except (struct.error, zlib.error, UnicodeDecodeError):
+        return None
+
+    if magic != MAGIC:
+        return None
+
+    return (score, aligned[:size], aligned[size:])
+
+def store(key, score, aligned1, aligned2, cache_dir=CACHE_DIR, max_size=CACHE_SIZE):
+    """
+    Description:
+        This function caches an alignment, as the header followed by both
+        aligned sequences zlib compressed together. The entry is written to a
+        temporary file and renamed into place, so parallel runs never read a
+        partial entry, and the cache is then evicted back down to max_size.
+
+    Parameters:
+        - key (str): the key from cache_key
+        - score (int): the alignment score
+        - aligned1 (str): seq1 adjusted to be aligned with seq2
+        - aligned2 (str): seq2 adjusted to be aligned with seq1
+        - cache_dir (str)(optional): the cache directory. Default to CACHE_DIR.
+        - max_size (int)(optional): the most space (bytes) the cache may use.
+            Default to CACHE_SIZE.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+
+    data = HEADER.pack(MAGIC, score, len(aligned1)) + zlib.compress((aligned1 + aligned2).encode())
+
+    with tempfile.NamedTemporaryFile('wb', dir=cache_dir, suffix='.tmp', delete=False) as file:
+        file.write(data)
+    os.replace(file.name, os.path.join(cache_dir, f'{key}.aln'))
+
+    evict(cache_dir, max_size)
+
+def evict(cache_dir=CACHE_DIR, max_size=CACHE_SIZE):
+    """
+    Description:
+        This function removes the least recently used entries until the cache
+        fits in max_size.
+
+    Parameters:
+        - cache_dir (str)(optional): the cache directory. Default to CACHE_DIR.
+        - max_size (int)(optional): the most space (bytes) the cache may use.
+            Default to CACHE_SIZE.
+    """
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith('.aln'):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for mtime, size, path in entries)
+
+    # oldest first
+    for mtime, size, path in sorted(entries):
+        if total <= max_size:
+            break
+
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass # another run evicted it first
+        total -= size
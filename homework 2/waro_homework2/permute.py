@@ -1,40 +1,200 @@
 from align_proteins import *
-import random
+import random, math, os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 
-def main(seq1_file, seq2_file):
+# the fewest permutations an adaptive run scores before it may stop
+MIN_PERMUTATIONS = 100
+
+def main(seq1_file, seq2_file, permutations=100, batch_size=50, seed=None, workers=None, precision=None):
     """
     Description:
         This function randomly shuffles seq1_file, and then performs needleman_wunsch
-        to align seq1_file and seq2_file.
+        to align seq1_file and seq2_file. Only the scores are needed, so the
+        shuffles are scored a batch at a time with the score-only kernel,
+        spread over a process pool by run_permutations.
 
     Parameters:
         - seq1_file (str): this is the file path to sequence 1
         - seq2_file (str): this is the file path to sequence 2
+        - permutations (int)(optional): the (most) number of shuffles. Default to 100.
+        - batch_size (int)(optional): the number of shuffles scored together.
+            Default to 50.
+        - seed (int)(optional): the master seed every shuffle is derived from.
+            Default to None, picking (and printing) a random one.
+        - workers (int)(optional): the number of worker processes. Default to
+            None, the number of cpus.
+        - precision (float)(optional): stop early once the p-value is resolved
+            to this precision. Default to None, running every permutation.
     """
     seq1 = open_file(seq1_file)
     seq2 = open_file(seq2_file)
 
-    with open('permutations_S_proteins.csv', 'w') as file:
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    print(f'Seed: {seed}') # the run can be reproduced with this seed
+
+    observed = score_batch([seq1], seq2)[0]
+    p_value, done = run_permutations(seq1, seq2, observed, permutations, seed, workers, batch_size, precision)
+
+    print(f'Score: {observed}')
+    print(f'p-value: {p_value} ({done} permutations)')
+
+def shuffle_sequence(seq, seed, index):
+    """
+    Description:
+        This function shuffles a sequence with a random generator seeded from
+        the master seed and the permutation index, so every permutation is the
+        same no matter which worker runs it, or in what order.
+
+    Parameters:
+        - seq (str): the sequence to be shuffled
+        - seed (int): the master seed of the run
+        - index (int): the number of the permutation
+
+    Returns:
+        - (str): the shuffled sequence
+    """
+    new_seq = list(seq)
+    random.Random(f'{seed}-{index}').shuffle(new_seq)
+    return ''.join(new_seq)
+
+def score_permutations(seq1, seq2, seed, indices):
+    """
+    Description:
+        This function shuffles seq1 once per permutation index and scores the
+        shuffles against seq2 as a single batch. It is the unit of work handed
+        to each worker process.
+
+    Parameters:
+        - seq1 (str): the sequence to be shuffled
+        - seq2 (str): the sequence the shuffles are aligned with
+        - seed (int): the master seed of the run
+        - indices (range): the permutation indices of the batch
+
+    Returns:
+        - (list(tuple)): the (permutation index, score) of each shuffle
+    """
+    batch = [shuffle_sequence(seq1, seed, index) for index in indices]
+    return list(zip(indices, score_batch(batch, seq2)))
+
+def run_permutations(seq1, seq2, observed, permutations=1000, seed=0, workers=None, batch_size=50, precision=None):
+    """
+    Description:
+        This function runs the permutation test of the observed score over a
+        process pool. Batches of shuffles are handed to the workers, and the
+        scores are written to permutations_S_proteins.csv in permutation order,
+        one per line under a score header.
+        Every shuffle's seed is derived from the master seed and its index, so a
+        run is reproducible whatever the number of workers.
+
+        With a precision, the run stops early once the 95% (wilson) confidence
+        interval of the p-value is at most +/- precision wide, after at least
+        MIN_PERMUTATIONS, as more permutations can't change the conclusion.
+        Batches may finish in any order, so they are held back until all the
+        permutations before them are in, and the stopping rule is checked one
+        permutation at a time in index order. A seed always stops at the same
+        permutation.
+
+    Parameters:
+        - seq1 (str): the sequence to be shuffled
+        - seq2 (str): the sequence the shuffles are aligned with
+        - observed (int): the alignment score of seq1 and seq2
+        - permutations (int)(optional): the (most) number of shuffles. Default
+            to 1000.
+        - seed (int)(optional): the master seed of the run. Default to 0.
+        - workers (int)(optional): the number of worker processes. Default to
+            None, the number of cpus.
+        - batch_size (int)(optional): the number of shuffles per batch.
+            Default to 50.
+        - precision (float)(optional): the p-value precision to stop at.
+            Default to None, running every permutation.
+
+    Returns tuple(p_value, done):
+        - p_value (float): the empirical p-value, (1 + #scores >= observed) /
+            (1 + #permutations)
+        - done (int): the number of permutations scored
+    """
+    workers = workers or os.cpu_count()
+    batches = (range(start, min(start + batch_size, permutations)) for start in range(0, permutations, batch_size))
+
+    done, exceeded = 0, 0
+    converged = False
+    finished_batches = {} # the scores of the batches that finished ahead of the ones before them
+
+    with ProcessPoolExecutor(workers) as pool, open('permutations_S_proteins.csv', 'w') as file:
         file.write('score\n')
-        for i in range(100):
-            if i % 10 == 0 and i != 0: print(f'{i}%') # track progress
 
-            # shuffle the first sequence
-            new_seq_1 = list(seq1)
-            random.shuffle(new_seq_1)
-            new_seq_1 = ''.join(new_seq_1)
+        # keep a couple of batches per worker in flight
+        pending = set()
+        for indices in batches:
+            pending.add(pool.submit(score_permutations, seq1, seq2, seed, indices))
+            if len(pending) >= 2 * workers:
+                break
+
+        while pending and not converged:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in finished:
+                scores = future.result()
+                finished_batches[scores[0][0]] = scores
+
+            # count the permutations in index order, as far as every batch is in
+            while done in finished_batches and not converged:
+                for _, score in finished_batches.pop(done):
+                    file.write(f'{score}\n')
+                    exceeded += score >= observed
+                    done += 1
 
-            # align sequences and write the score to file
-            score, aligned1, aligned2 = needleman_wunsch(new_seq_1, seq2)
-            file.write(f'{score}\n')
+                    # the p-value is resolved, the rest of the permutations can't change it
+                    if precision is not None and done >= MIN_PERMUTATIONS and wilson_width(exceeded, done) <= precision:
+                        converged = True
+                        break
+
+            # drop the queued batches, only the ones already running are waited for
+            if converged:
+                pool.shutdown(wait=False, cancel_futures=True)
+                break
+
+            # top the workers back up
+            for indices in batches:
+                pending.add(pool.submit(score_permutations, seq1, seq2, seed, indices))
+                if len(pending) >= 2 * workers:
+                    break
+
+    return ((exceeded + 1) / (done + 1), done)
+
+def wilson_width(exceeded, done, z=1.96):
+    """
+    Description:
+        This function computes the half width of the wilson score interval of
+        the proportion exceeded / done. Unlike the normal approximation, it
+        doesn't collapse to 0 when (almost) every or no shuffle exceeds the
+        observed score.
+
+    Parameters:
+        - exceeded (int): the number of shuffles scoring at least the observed
+            score
+        - done (int): the number of shuffles
+        - z (float)(optional): the normal quantile of the confidence level.
+            Default to 1.96, 95%.
+
+    Returns:
+        - (float): the half width of the interval
+    """
+    proportion = exceeded / done
+    return z / (1 + z * z / done) * math.sqrt(proportion * (1 - proportion) / done + z * z / (4 * done * done))
 
 if __name__ == '__main__':
-    # extract command line args for seq1 file, seq2 file, and [matches] file
+    # extract command line args for seq1 file, seq2 file, [permutations], [seed]
+    # and [precision]
     try:
         seq1_file = sys.argv[1]
         seq2_file = sys.argv[2]
+        permutations = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+        seed = int(sys.argv[4]) if len(sys.argv) > 4 else None
+        precision = float(sys.argv[5]) if len(sys.argv) > 5 else None
 
-        main(seq1_file, seq2_file)
+        main(seq1_file, seq2_file, permutations, seed=seed, precision=precision)
 
     # issues finding command line arguments
     except Exception as e:
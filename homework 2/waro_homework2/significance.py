@@ -0,0 +1,195 @@
+from permute import *
+import hashlib, json, math, os, tempfile
+import numpy as np
+
+# where the fitted gumbel parameters are kept between runs
+CACHE_FILE = 'gumbel_cache.json'
+
+# part of every cache key, bump it whenever score_batch's scoring changes so
+# older fits aren't reused
+SCORING_VERSION = 'nw+1-3-2:v1'
+
+def main(seq1_file, seq2_file, samples=200):
+    """
+    Description:
+        This function reports the significance of the needleman_wunsch score of
+        seq1_file and seq2_file from a gumbel (extreme value) distribution fitted
+        to the scores of shuffled alignments, instead of counting permutations.
+
+    Parameters:
+        - seq1_file (str): this is the file path to sequence 1
+        - seq2_file (str): this is the file path to sequence 2
+        - samples (int)(optional): the number of shuffles in the calibration
+            batch. Default to 200.
+    """
+    seq1 = open_file(seq1_file)
+    seq2 = open_file(seq2_file)
+
+    score, p_value, e_value = significance(seq1, seq2, samples=samples)
+
+    print(f'Score: {score}')
+    print(f'p-value: {p_value}')
+    print(f'E-value: {e_value}')
+
+def significance(seq1, seq2, score=None, comparisons=1, samples=200):
+    """
+    Description:
+        This function computes the p-value and E-value of an alignment score of
+        seq1 and seq2 from the calibrated gumbel parameters.
+
+    Parameters:
+        - seq1 (str): sequence 1 of 2 (the one that gets shuffled)
+        - seq2 (str): sequence 2 of 2
+        - score (int)(optional): the alignment score. Default to None, the
+            needleman_wunsch score of seq1 and seq2.
+        - comparisons (int)(optional): the number of alignments the score was
+            picked from (e.g. a database size), scaling the E-value. Default to 1.
+        - samples (int)(optional): the number of shuffles in the calibration
+            batch, if seq1 and seq2 haven't been calibrated yet. Default to 200.
+
+    Returns tuple(score, p_value, e_value):
+        - score (int): the alignment score
+        - p_value (float): the probability of a shuffled alignment scoring at
+            least score
+        - e_value (float): the expected number of shuffled alignments scoring at
+            least score over the comparisons
+    """
+    if score is None:
+        score = score_batch([seq1], seq2)[0]
+
+    location, scale = calibrate(seq1, seq2, samples)
+
+    # P(S >= score) = 1 - exp(-exp(-(score - location) / scale))
+    expected = math.exp(-(score - location) / scale)
+    p_value = -math.expm1(-expected)
+
+    return (score, p_value, comparisons * expected)
+
+def calibrate(seq1, seq2, samples=200, seed=0, workers=None):
+    """
+    Description:
+        This function fits the gumbel parameters of the scores of seq1's shuffles
+        aligned with seq2. The parameters only depend on seq1's length and
+        composition (which shuffling keeps), on seq2 and on the calibration
+        itself (samples, seed and scoring), so they are cached in CACHE_FILE
+        under that key and later queries need no permutations.
+
+    Parameters:
+        - seq1 (str): the sequence that gets shuffled
+        - seq2 (str): the sequence the shuffles are aligned with
+        - samples (int)(optional): the number of shuffles in the calibration
+            batch. Default to 200.
+        - seed (int)(optional): the master seed of the shuffles. Default to 0.
+        - workers (int)(optional): the number of worker processes. Default to
+            None, the number of cpus.
+
+    Returns tuple(location, scale):
+        - location (float): the gumbel location (mode) of the shuffled scores
+        - scale (float): the gumbel scale (1 / lambda) of the shuffled scores
+    """
+    composition = ''.join(f'{base}{seq1.count(base)}' for base in sorted(set(seq1)))
+    key = f'{SCORING_VERSION}:{samples}:{seed}:{len(seq1)}:{composition}:{hashlib.sha1(seq2.encode()).hexdigest()}'
+
+    cache = load_cache()
+    if key in cache:
+        return tuple(cache[key])
+
+    # score the calibration batch over a process pool
+    batch_size = 50
+    batches = [range(start, min(start + batch_size, samples)) for start in range(0, samples, batch_size)]
+    with ProcessPoolExecutor(workers or os.cpu_count()) as pool:
+        futures = [pool.submit(score_permutations, seq1, seq2, seed, indices) for indices in batches]
+        scores = [score for future in futures for index, score in future.result()]
+
+    location, scale = fit_gumbel(scores)
+
+    # other runs may have added entries since the cache was loaded
+    cache = load_cache()
+    cache[key] = [location, scale]
+    save_cache(cache)
+
+    return (location, scale)
+
+def fit_gumbel(scores):
+    """
+    Description:
+        This function fits a gumbel distribution to the scores by maximum
+        likelihood, starting from the method of moments estimate and solving
+        scale = mean - sum(x * e^(-x / scale)) / sum(e^(-x / scale)) with
+        newton's method.
+
+    Parameters:
+        - scores (list(int)): the scores of the shuffled alignments
+
+    Returns tuple(location, scale):
+        - location (float): the gumbel location
+        - scale (float): the gumbel scale
+    """
+    x = np.asarray(scores, dtype=np.float64)
+    mean = x.mean()
+    x = x - mean # centered, which keeps the exponentials in range
+
+    # method of moments. std = scale * pi / sqrt(6)
+    scale = max(x.std() * math.sqrt(6) / math.pi, 1e-9)
+
+    for i in range(100):
+        weights = np.exp(-x / scale)
+        total = weights.sum()
+        weighted = (x * weights).sum() / total
+        squared = (x * x * weights).sum() / total
+
+        # f(scale) = scale + weighted, with mean(x) == 0 after centering
+        error = scale + weighted
+        slope = 1 + (squared - weighted * weighted) / (scale * scale)
+        step = error / slope
+
+        scale = max(scale - step, scale / 2)
+        if abs(step) < 1e-10 * scale:
+            break
+
+    location = mean - scale * math.log(np.exp(-x / scale).mean())
+
+    return (float(location), float(scale))
+
+def load_cache():
+    """
+    Description:
+        This function loads the cached gumbel parameters.
+
+    Returns:
+        - (dict): the [location, scale] of each calibrated key
+    """
+    try:
+        with open(CACHE_FILE) as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_cache(cache):
+    """
+    Description:
+        This function saves the gumbel parameters, replacing the cache file
+        atomically so concurrent runs never read a partial file.
+
+    Parameters:
+        - cache (dict): the [location, scale] of each calibrated key
+    """
+    directory = os.path.dirname(os.path.abspath(CACHE_FILE))
+    with tempfile.NamedTemporaryFile('w', dir=directory, delete=False) as file:
+        json.dump(cache, file)
+    os.replace(file.name, CACHE_FILE)
+
+if __name__ == '__main__':
+    # extract command line args for seq1 file, seq2 file, and [samples]
+    try:
+        seq1_file = sys.argv[1]
+        seq2_file = sys.argv[2]
+
+        if len(sys.argv) > 3:
+            main(seq1_file, seq2_file, int(sys.argv[3]))
+        else:
+            main(seq1_file, seq2_file)
+
+    # any exceptions occured. Report error message.
+    except Exception as e:
+        print(f'significance.py quit due to the following error: {e}')
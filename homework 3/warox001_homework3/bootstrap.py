@@ -1,20 +1,32 @@
 import random
+import numpy as np
 import distances
 import collections
 import buildTree
 
-def generate_bootstraps(tree, data):
+def generate_bootstraps(tree, data, engine='strings', seed=None):
     '''
     Description:
         This function performs 100 inferences of bootstrap sampling to generate a partition
         confidence value for each node in the original phylogenic tree that we constructed.
 
+        The 'multinomial' engine never builds the resampled sequences. A bootstrap sample is just the
+        number of times each column is drawn, so it draws those counts with numpy, and computes the
+        distances from the weighted site patterns of the alignment (see weighted_distances).
+
     Parameters:
         - tree (dict): the original pyhlogenic tree constructed for our data
         - data (list(list)): the sequence tips data in the format [[tip_id, sequence], ... , [last_tip_id, last_sequence]]
+        - engine (str)(optional): 'strings' builds each bootstrap sample's sequences, 'multinomial' weighs
+          the columns instead. Default to 'strings'.
+        - seed (int)(optional): the seed of the 'multinomial' engine's draws. Default to None, a random one.
     '''
     length = len(data[0][1]) # length of a sequence (they're all the same length)
 
+    if engine == 'multinomial':
+        rng = np.random.default_rng(seed)
+        one_hot, inverse = site_patterns(data)
+
     # this will hold the count of how often a node's substructure is found in the boostrapped trees
     node_counts = {node:0 for node in tree}
 
@@ -31,24 +43,31 @@ def generate_bootstraps(tree, data):
     
     # 100 inferences of the tree
     for inference in range(100):
-        # temporary storage of the sequences for each node
-        temp = {seq[0]:'' for seq in data}
-
-        # sample length columns
-        for step in range(length):
-            # the random sequence position to be added to the bootstrap sample
-            col = random.randint(0, length - 1)
-            
-            # add the base at position col of each original sequence to the boostrap sequence for each tip
-            for sequence in data:
-                val = sequence[1][col] # grab the base at position: col
-                node = sequence[0] # get the node 
-                temp[node] = temp[node] + val # update the bootstrap sequence
-
-        # generate new tree for this bootstrap sample
-        new_data = [[key, temp[key]] for key in temp]
-        new_distance_matrix = distances.compute_distances(new_data, False)
-        new_tree = buildTree.resolve_tree(new_distance_matrix, [str(row[0]) for row in new_data], False)
+        if engine == 'multinomial':
+            # the number of times each column is drawn, out of length draws
+            counts = rng.multinomial(length, np.full(length, 1 / length))
+            new_distance_matrix = weighted_distances(one_hot, inverse, counts)
+            new_tree = buildTree.resolve_tree(new_distance_matrix, [str(row[0]) for row in data], False)
+
+        else:
+            # temporary storage of the sequences for each node
+            temp = {seq[0]:'' for seq in data}
+
+            # sample length columns
+            for step in range(length):
+                # the random sequence position to be added to the bootstrap sample
+                col = random.randint(0, length - 1)
+
+                # add the base at position col of each original sequence to the boostrap sequence for each tip
+                for sequence in data:
+                    val = sequence[1][col] # grab the base at position: col
+                    node = sequence[0] # get the node
+                    temp[node] = temp[node] + val # update the bootstrap sequence
+
+            # generate new tree for this bootstrap sample
+            new_data = [[key, temp[key]] for key in temp]
+            new_distance_matrix = distances.compute_distances(new_data, False)
+            new_tree = buildTree.resolve_tree(new_distance_matrix, [str(row[0]) for row in new_data], False)
 
         # compare the new tree to the old tree and count bootstrap confidence
         for node in new_tree:
@@ -91,6 +110,59 @@ def generate_bootstraps(tree, data):
 
                 line = edges.readline()
 
+def site_patterns(data):
+    '''
+    Description:
+        This function collapses the alignment's identical columns into site patterns, and one-hot encodes
+        the character of every sequence at every pattern.
+
+    Parameters:
+        - data (list(list)): the sequence tips data in the format [[tip_id, sequence], ... , [last_tip_id, last_sequence]]
+
+    Returns tuple(one_hot, inverse):
+        - one_hot (np.ndarray): the N x patterns x characters one-hot encoding of the patterns
+        - inverse (np.ndarray): the pattern of each column of the alignment
+    '''
+    codes = distances.encode_alignment(data)
+    patterns, inverse = np.unique(codes, axis=1, return_inverse=True)
+    characters = np.unique(patterns)
+
+    one_hot = (patterns[:, :, None] == characters).astype(np.float64)
+    return (one_hot, inverse.reshape(-1))
+
+def weighted_distances(one_hot, inverse, counts):
+    '''
+    Description:
+        This function computes the distance matrix of a bootstrap sample from the number of times each column
+        was drawn. Two sequences match at a pattern when they share its character, so the weighted number of
+        matching columns of every pair is a single matrix product of the one-hot patterns, each weighted by
+        its draws. The distances are 1 - matches / length, as in distances.compute_distances.
+
+    Parameters:
+        - one_hot (np.ndarray): the one-hot encoded patterns from site_patterns
+        - inverse (np.ndarray): the pattern of each column from site_patterns
+        - counts (np.ndarray): the number of times each column was drawn
+
+    Returns:
+        - matrix (list(list)): the distance_matrix holding genetic distances between each pair of sequences
+    '''
+    size, patterns, characters = one_hot.shape
+    length = int(counts.sum())
+
+    # the draws of each pattern
+    weights = np.bincount(inverse, weights=counts, minlength=patterns)
+
+    encoded = one_hot.reshape(size, -1)
+    same = (encoded * np.repeat(weights, characters)) @ encoded.T
+
+    matrix = (1 - same / length).tolist()
+
+    # save the diagonal as 0s
+    for i in range(size):
+        matrix[i][i] = 0
+
+    return matrix
+
 def get_tips(tree, current, tip_list, size):
     '''
     Description:
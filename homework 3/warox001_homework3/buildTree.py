@@ -1,16 +1,32 @@
 import copy, collections
+import numpy as np
 from operator import itemgetter
 
-def resolve_tree(distance_matrix, sequence_list, save):
+# the slack (relative to the largest row sum) under which q-values of the rapid search are treated as a possible tie
+# and rechecked with exact row sums. The incrementally updated row sums drift far less than this
+TIE_TOLERANCE = 1e-9
+
+def resolve_tree(distance_matrix, sequence_list, save, engine='numpy'):
     '''
     Description:
         This function is responsible for generating a tree given a distance matrix and a list of sequence tips.
         This function performs this operation by performing a neighbor joining algorithm
 
+        The distances are kept in a preallocated numpy array, the joined node taking over the slot of one of its
+        children, so the q-matrix is a single vectorized expression and each join is O(n^2). The remaining nodes
+        are ordered like the original list based implementation (newly formed nodes at the front), and the row
+        sums are added up left to right in that order (cumsum), like python's sum. Neighbor joining has exact ties
+        between q-values (every 4 node step has two), decided by the rounding of those sums, so the tree is the
+        same as the list based implementation's.
+
+        The 'rapid' engine searches the q-matrix the RapidNJ way instead (see rapid_join), for thousands of tips.
+
     Parameters:
-        - distance_matrix (list(list)): matrix of distances between all tip pairs
+        - distance_matrix (list(list) or np.ndarray): matrix of distances between all tip pairs
         - sequence_list (list): list of all the sequence tips in the data
         - save (boolean): true/false value that decides if we want to save the edges & newick tree files.
+        - engine (str)(optional): 'numpy' scans the whole q-matrix on every join, 'rapid' only the parts of it that
+          can hold the minimum. Both give the same tree. Default to 'numpy'.
 
     Returns:
         - tree (dict): the representative newick tree given the distance matrix. 
@@ -21,67 +37,48 @@ def resolve_tree(distance_matrix, sequence_list, save):
     count = size * 2 - 2 # number of initial tips + number of internal nodes that will be formed
     lookup = {sequence_list[i]: i + 1 for i in range(size)} # mapping of each tip id to it's position in the sequence list
 
+    distances = np.array(distance_matrix, dtype=np.float64).reshape(size, size)
+    nodes = [lookup[tip] for tip in sequence_list] # the tree node held in each slot
+    order = list(range(size)) # the slots in list order
+
+    if engine == 'rapid':
+        tree, order = rapid_join(distances, nodes)
+        count = sizeCopy # all the joins are done
+
     # Neighbor joining algorithm, completes size - 2 joins
     while count > sizeCopy:
+        current = np.array(order)
+        sub_matrix = distances[np.ix_(current, current)]
+        sums = np.cumsum(sub_matrix, axis=1)[:, -1] # sequential, not pairwise, summation
 
-        # create the space for the q-matrix
-        q_matrix = [[None for seq in sequence_list] for sequence in sequence_list]
-
-        min_val = size - 1 # track the minimum val
-        min_row = 0 # track the row of the minimum val
-        min_col = 0 # track the column of the minimum val
-
-        # calculate q-matrix
-        # we only need to do 1/2 the matrix by using the fact that the matrix is symmetrical
-        # across the diagonal
-        for row in range(size):
-            for col in range(size - row):
-                # skip self comparison
-                if row == col + row:
-                    val = None
-                else:
-                    # calculate distance
-                    val = (size - 2) * distance_matrix[row][col+row] - sum(distance_matrix[row]) - sum([sequence[col+row] for sequence in distance_matrix])
-                    
-                    # update minimum value accordingly
-                    if (val < min_val):
-                        min_val, min_row, min_col = (val, row, col + row)
-
-                # update q-matrix value
-                q_matrix[row][col+row] = val
-                q_matrix[col+row][row] = val
+        # calculate q-matrix, only the upper triangle (row < col) is searched, and the first minimum (row by row)
+        # is kept
+        q_matrix = (size - 2) * sub_matrix - sums[:, None] - sums[None, :]
+        q_matrix[np.tril_indices(size)] = np.inf
+        min_row, min_col = divmod(int(np.argmin(q_matrix)), size)
+
+        row_slot, col_slot = order[min_row], order[min_col]
+        others = [slot for slot in order if slot not in (row_slot, col_slot)]
 
         # count is the number of the new node
         # calculate distances from the row tip/node to the new node, and the distance from the col tip/node to the new node
-        dist_row_u = 0.5 * distance_matrix[min_row][min_col] + (1 / (2 * (size - 2))) * (sum(distance_matrix[min_row]) - sum([seq[min_col] for seq in distance_matrix]))
-        dist_col_u = distance_matrix[min_row][min_col] - dist_row_u
+        distance = distances[row_slot, col_slot]
+        dist_row_u = 0.5 * distance + (1 / (2 * (size - 2))) * (sums[min_row] - sums[min_col])
+        dist_col_u = distance - dist_row_u
 
-        # grab the node position value, and then update the tree with the two descendants
-        actual_row = sequence_list[min_row] if 62 <= int(sequence_list[min_row]) <= 120 else lookup[sequence_list[min_row]]
-        actual_col = sequence_list[min_col] if 62 <= int(sequence_list[min_col]) <= 120 else lookup[sequence_list[min_col]]
-        tree[count] = [(count, actual_row, dist_row_u), (count, actual_col, dist_col_u)]
+        # update the tree with the two descendants
+        tree[count] = [(count, nodes[row_slot], float(dist_row_u)), (count, nodes[col_slot], float(dist_col_u))]
 
         # get the distances to the new node from the rest of the tree
-        new_node_distances = [0.5 * (distance_matrix[min_row][i] + distance_matrix[i][min_col] - distance_matrix[min_row][min_col]) for i in range(size) if i not in (min_row, min_col)]
-        new_node_distances.insert(0, 0)
-
-        # remove the old nodes from the table, and insert the newly formed node
-        sequence_list.pop(min(min_row, min_col))
-        sequence_list.pop(max(min_row, min_col)-1)
-        sequence_list.insert(0, count)
-
-        # update the distance matrix, and add the new node distances to the front of the matrix
-        distance_matrix = [distance_matrix[row] for row in range(size) if row not in (min_row, min_col)]
-        for row in distance_matrix:
-            row.pop(min(min_row, min_col))
-            row.pop(max(min_row, min_col)-1)
-
-        # update the matrix
-        distance_matrix.insert(0, new_node_distances)
-        counter = 1
-        for row in distance_matrix[1:]:
-            row.insert(0, new_node_distances[counter])
-            counter += 1
+        new_node_distances = 0.5 * (distances[row_slot, others] + distances[others, col_slot] - distance)
+
+        # the new node takes the row's slot, the column's slot leaves the tree
+        distances[row_slot, others] = new_node_distances
+        distances[others, row_slot] = new_node_distances
+        nodes[row_slot] = count
+
+        # the new node goes to the front of the list
+        order = [row_slot] + others
 
         # update trackers
         size -= 1
@@ -89,26 +86,145 @@ def resolve_tree(distance_matrix, sequence_list, save):
 
     # add the final connection in the tree
     lst = tree[sizeCopy+1]
-    # if the remaining connection is to a newly created internal node (int)
-    if type(sequence_list[len(sequence_list)-1]) == int:
-        lst.append((sizeCopy+1, sequence_list[len(sequence_list)-1], distance_matrix[0][1]))
-
-    # else last connection is to an original tip (str)
-    else:
-        lst.append((sizeCopy+1, lookup[sequence_list[len(sequence_list)-1]], distance_matrix[0][1]))
+    lst.append((sizeCopy+1, nodes[order[-1]], float(distances[order[0], order[-1]])))
     tree[sizeCopy+1] = lst
 
     # sort the children at each node on the descendant node value for consistency
-    try:
-        tree = {node: sorted(tree[node], key=itemgetter(1)) for node in tree}
-    except:
-        print(tree)
+    tree = {node: sorted(tree[node], key=itemgetter(1)) for node in tree}
 
     # save the edge and newick tree files
     if save: save_files(tree, sizeCopy, lookup)
 
     return tree
 
+def rapid_join(distances, nodes):
+    '''
+    Description:
+        This function performs the neighbor joins of resolve_tree, finding each minimum q-value without computing
+        the whole q-matrix (RapidNJ). Every row keeps its columns sorted on their distance, and since
+        q = (size - 2) * distance - row sum - column sum, no q-value past a point in a row can be lower than
+        (size - 2) * distance - row sum - the largest row sum. The rows are read together, a growing chunk at a time,
+        and each row only until its bound passes the best q-value found, which usually leaves a small fraction of
+        the cells.
+
+        Each pair is searched from one row only: the row of the newer node, or of the first slot of two tips. The
+        join that formed the node in each slot is kept (born), so the entries of nodes joined or formed since a row
+        was sorted are stale, and skipped. The row sums are updated incrementally, so the q-values within
+        TIE_TOLERANCE of the best are rechecked with the exact (list order) row sums and ties broken like
+        resolve_tree, which keeps the tree the same.
+
+    Parameters:
+        - distances (np.ndarray): the (size x size) distance matrix, updated in place
+        - nodes (list): the tree node held in each slot, updated in place
+
+    Returns tuple(tree, order):
+        - tree (dict): the joined nodes. node: [(node, descendant1, distance1), (node, descendant2, distance2)]
+        - order (np.ndarray): the slots still in the tree, in list order
+    '''
+    tree = {}
+    size = len(nodes)
+    count = size * 2 - 2
+
+    # the columns after each tip's slot, sorted on their distance, are read from head to length
+    sorted_cols = np.zeros((size, size), dtype=np.int32)
+    for row in range(size - 1):
+        sorted_cols[row, :size-row-1] = np.argsort(distances[row, row+1:], kind='stable') + row + 1
+    head = np.zeros(size, dtype=np.int64)
+    length = np.arange(size - 1, -1, -1)
+
+    born = np.zeros(size, dtype=np.int64) # the join that formed the node in each slot, 0 for tips
+    alive = np.ones(size, dtype=bool)
+    key = np.arange(size) # sorts the slots in list order, newly formed nodes at the front
+    sums = distances.sum(axis=1)
+    order = np.arange(size)
+
+    for step in range(1, len(nodes) - 1):
+        # move each head past the stale entries
+        pending = order
+        while len(pending):
+            pending = pending[head[pending] < length[pending]]
+            cols = sorted_cols[pending, head[pending]]
+            pending = pending[~(alive[cols] & (born[cols] <= born[pending]))]
+            head[pending] += 1
+
+        largest = sums[order].max()
+        slack = TIE_TOLERANCE * (abs(largest) + 1)
+
+        # read all the rows together, a growing chunk at a time, dropping each row once its bound passes the best
+        # q-value found
+        rows = order[head[order] < length[order]]
+        position = head[rows]
+        floor = distances[rows, sorted_cols[rows, position]] # the heads are valid entries
+        best = np.inf
+        found = [] # the (rows, cols, q-values) within slack of the best
+        width = 8
+        while len(rows):
+            columns = position[:, None] + np.arange(width)
+            cols = sorted_cols[rows[:, None], np.minimum(columns, len(nodes) - 1)]
+            row_distances = distances[rows[:, None], cols]
+            q_values = (size - 2) * row_distances - sums[rows, None] - sums[cols]
+
+            valid = (columns < length[rows, None]) & alive[cols] & (born[cols] <= born[rows, None])
+            if valid.any():
+                best = min(best, q_values[valid].min())
+            keep = valid & (q_values <= best + slack)
+            found.append((rows[np.nonzero(keep)[0]], cols[keep], q_values[keep]))
+
+            # stale entries hold the distances of newer nodes, out of order, so the rest of the row is bounded by the
+            # last valid distance read
+            floor = np.maximum(floor, np.where(valid, row_distances, -np.inf).max(axis=1))
+            position += width
+            more = (position < length[rows]) & ((size - 2) * floor - sums[rows] - largest <= best + slack)
+            rows, position, floor = rows[more], position[more], floor[more]
+            width *= 2
+
+        rows, cols, q_values = (np.concatenate(part) for part in zip(*found))
+        near = q_values <= best + slack
+        rows, cols = rows[near], cols[near]
+
+        # recheck the candidates like resolve_tree, the earlier slot in list order being the row
+        first_slots = np.where(key[rows] < key[cols], rows, cols)
+        second_slots = np.where(key[rows] < key[cols], cols, rows)
+        slots = np.unique(np.concatenate((first_slots, second_slots)))
+        exact = dict(zip(slots.tolist(), np.cumsum(distances[np.ix_(slots, order)], axis=1)[:, -1]))
+        first_sums = np.array([exact[slot] for slot in first_slots.tolist()])
+        second_sums = np.array([exact[slot] for slot in second_slots.tolist()])
+        q_values = (size - 2) * distances[first_slots, second_slots] - first_sums - second_sums
+        index = np.lexsort((key[second_slots], key[first_slots], q_values))[0]
+        row_slot, col_slot = int(first_slots[index]), int(second_slots[index])
+
+        others = order[(order != row_slot) & (order != col_slot)]
+
+        # count is the number of the new node
+        distance = distances[row_slot, col_slot]
+        dist_row_u = 0.5 * distance + (1 / (2 * (size - 2))) * (first_sums[index] - second_sums[index])
+        dist_col_u = distance - dist_row_u
+        tree[count] = [(count, nodes[row_slot], float(dist_row_u)), (count, nodes[col_slot], float(dist_col_u))]
+
+        # the new node takes the row's slot, the column's slot leaves the tree
+        new_node_distances = 0.5 * (distances[row_slot, others] + distances[others, col_slot] - distance)
+        sums[others] += new_node_distances - distances[others, row_slot] - distances[others, col_slot]
+        distances[row_slot, others] = new_node_distances
+        distances[others, row_slot] = new_node_distances
+        sums[row_slot] = new_node_distances.sum()
+        nodes[row_slot] = count
+        alive[col_slot] = False
+
+        # the new node's row holds its pairs with every other node
+        born[row_slot] = step
+        key[row_slot] = -step
+        sorted_cols[row_slot, :len(others)] = others[np.argsort(new_node_distances, kind='stable')]
+        head[row_slot] = 0
+        length[row_slot] = len(others)
+
+        # the new node goes to the front of the list
+        order = np.concatenate(([row_slot], others))
+
+        size -= 1
+        count -= 1
+
+    return (tree, order)
+
 def save_files(tree, size, lookup):
     '''
     Description:
@@ -1,3 +1,23 @@
+import os, sys
+import numpy as np
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+# the compressed file readers are shared by every homework (seqio.py, two
+# directories up)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from seqio import open_text
+
+# the most memory (bytes) the comparisons of one block of sequences may use, and
+# of one tile of packed sequences (small enough to stay in cache)
+BLOCK_BYTES = 16 * 1024 ** 2
+TILE_BYTES = 1024 ** 2
+
+# the even bit of every 2-bit base of a packed word, and the number of set bits
+# of each byte value
+EVEN_BITS = np.uint64(0x5555555555555555)
+BYTE_BITS = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
 def open_file(file_name):
     '''
     Description:
@@ -11,7 +31,7 @@ def open_file(file_name):
     '''
     data = []
 
-    with open(file_name, 'r') as file:
+    with open_text(file_name) as file:
         tmp = []
         line = file.readline()
         while line:
@@ -38,6 +58,11 @@ def compute_distances(data, save):
         This function is responsible for computing the genetic distance matrix between all of the sequences. It then
         makes sure to save the matrix to genetic-distances.txt
 
+        The sequences are loaded once into an N x L uint8 matrix and packed 2 bits per base with
+        pack_alignment, so count_mismatches compares 32 bases per 64-bit operation. Alignments with more than 4
+        characters besides ACGT fall back to count_matches, comparing the uint8 characters. Either way, only the
+        blocks on or above the diagonal are computed, and mirrored below it.
+
     Parameters:
         - data (list(list)): the sequence tips data in the format [[tip_id, sequence], ... , [last_tip_id, last_sequence]]
 
@@ -45,34 +70,341 @@ def compute_distances(data, save):
         - matrix (list(list)): the distance_matrix holding genetic distances between each pair of sequences
     '''
     size = len(data)
+    seqLength = len(data[0][1]) if size else 0
+
+    codes = encode_alignment(data)
+    packed = pack_alignment(codes)
+
+    # the number of matching positions between each pair of sequences
+    if packed is not None:
+        same = seqLength - count_mismatches(*packed)
+    else:
+        same = count_matches(codes)
+
+    # mirror the upper triangle
+    lower = np.tril_indices(size, -1)
+    same[lower] = same.T[lower]
 
     # this will serve as the genetic distance matrix
-    matrix = [[None for x in range(size)] for y in range(size)]
+    matrix = (1 - same / seqLength).tolist()
 
-    # iterate over all sequences and calculate the distance between each pair
+    # save the diagonal as 0s
     for i in range(size):
-        for j in range(size):
-
-            # calculate distance
-            if i != j:
-                seqLength = len(data[i][1])
-                same = 0
-
-                # calculate the genetic distance between sequence i and sequence j
-                for t in range(seqLength):
-                    if data[i][1][t] == data[j][1][t]:
-                        same += 1
-                
-                # save sequence length
-                matrix[i][j] = 1 - (same / seqLength)
-
-            # save the diagonal as 0s
-            else:
-                matrix[i][j] = 0
-    
+        matrix[i][i] = 0
+
     if save: save_distances(matrix, data, size) # save the distance matrix to file
     return matrix
 
+def compute_distances_parallel(data, output_name='genetic-distances.npy', workers=None, tile=512, text=False):
+    '''
+    Description:
+        This function computes the genetic distances like compute_distances, over a process pool. The encoded (packed
+        when possible) alignment is placed once in shared memory, and each worker computes tiles of rows x columns on
+        or above the diagonal, writing them straight into the condensed distance matrix: a memory-mapped .npy file of
+        the upper triangle, row by row ((0, 1), (0, 2), ..., (1, 2), ...). The tip ids are saved alongside it, one per
+        line, in <output_name>-ids.txt, and open_distances reads both back.
+
+    Parameters:
+        - data (list(list)): the sequence tips data in the format [[tip_id, sequence], ... , [last_tip_id, last_sequence]]
+        - output_name (str)(optional): the path of the condensed matrix. Default to genetic-distances.npy
+        - workers (int)(optional): the number of worker processes. Default to None, the number of cpus.
+        - tile (int)(optional): the rows and columns of each worker's tile. Default to 512.
+        - text (boolean)(optional): also save genetic-distances.txt with export_distances. Default to False.
+
+    Returns:
+        - condensed (np.memmap): the condensed distance matrix
+    '''
+    size = len(data)
+    seqLength = len(data[0][1]) if size else 0
+
+    codes = encode_alignment(data)
+    packed = pack_alignment(codes)
+    arrays = packed if packed is not None else (codes,)
+
+    with open(ids_name(output_name), 'w') as file:
+        file.writelines(f'{sequence[0]}\n' for sequence in data)
+
+    condensed = np.lib.format.open_memmap(output_name, mode='w+', dtype=np.float64, shape=(size * (size - 1) // 2,))
+    condensed.flush()
+
+    blocks = []
+    try:
+        # copy the alignment into shared memory once, the workers only attach to it
+        for array in arrays:
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+            blocks.append(block)
+        layout = [(block.name, array.shape, array.dtype.str) for block, array in zip(blocks, arrays)]
+
+        tiles = [((i, min(i + tile, size)), (j, min(j + tile, size))) for i in range(0, size, tile) for j in range(i, size, tile)]
+
+        with ProcessPoolExecutor(workers) as pool:
+            for future in [pool.submit(distance_tile, layout, rows, cols, size, seqLength, output_name) for rows, cols in tiles]:
+                future.result()
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    if text: export_distances(condensed, [sequence[0] for sequence in data])
+    return condensed
+
+def distance_tile(layout, rows, cols, size, seqLength, output_name):
+    '''
+    Description:
+        This function computes the distances of a tile of rows x columns, and writes the ones above the diagonal into
+        the condensed matrix. It is the unit of work handed to each worker process.
+
+    Parameters:
+        - layout (list(tuple)): the (shared memory name, shape, dtype) of each array of the encoded alignment, the
+            packed (bases, mask) planes or the uint8 character codes
+        - rows (tuple): the (start, stop) of the tile's rows
+        - cols (tuple): the (start, stop) of the tile's columns
+        - size (int): the number of sequences
+        - seqLength (int): the length of the sequences
+        - output_name (str): the path of the condensed matrix
+    '''
+    blocks = [shared_memory.SharedMemory(name=name) for name, shape, dtype in layout]
+    try:
+        arrays = [np.ndarray(shape, dtype, buffer=block.buf) for block, (name, shape, dtype) in zip(blocks, layout)]
+
+        if len(arrays) == 2:
+            same = seqLength - count_mismatches(*arrays, rows, cols)
+        else:
+            same = count_matches(arrays[0], rows, cols)
+        del arrays # the shared memory can't be closed while viewed
+
+        distances = 1 - same / seqLength
+
+        # each row's distances above the diagonal are contiguous in the condensed matrix
+        condensed = np.load(output_name, mmap_mode='r+')
+        for i in range(*rows):
+            start = max(cols[0], i + 1)
+            if start < cols[1]:
+                offset = condensed_index(i, start, size)
+                condensed[offset:offset + cols[1] - start] = distances[i - rows[0], start - cols[0]:]
+        condensed.flush()
+    finally:
+        for block in blocks:
+            block.close()
+
+def condensed_index(i, j, size):
+    '''
+    Description:
+        This function finds the position of the distance between sequences i < j in the condensed matrix.
+
+    Parameters:
+        - i (int or np.ndarray): the first sequence
+        - j (int or np.ndarray): the second sequence, after i
+        - size (int): the number of sequences
+
+    Returns:
+        - (int or np.ndarray): the position in the condensed matrix
+    '''
+    return i * (2 * size - i - 1) // 2 + j - i - 1
+
+def ids_name(output_name):
+    '''
+    Description:
+        This function names the tip ids index of a condensed matrix.
+
+    Parameters:
+        - output_name (str): the path of the condensed matrix
+
+    Returns:
+        - (str): the path of its tip ids index
+    '''
+    return os.path.splitext(output_name)[0] + '-ids.txt'
+
+def open_distances(output_name='genetic-distances.npy'):
+    '''
+    Description:
+        This function opens a condensed matrix saved by compute_distances_parallel, without reading it into memory.
+
+    Parameters:
+        - output_name (str)(optional): the path of the condensed matrix. Default to genetic-distances.npy
+
+    Returns tuple(ids, condensed):
+        - ids (list(str)): the tip ids, in order
+        - condensed (np.memmap): the condensed distance matrix
+    '''
+    with open(ids_name(output_name)) as file:
+        ids = file.read().splitlines()
+
+    # numpy can't map an empty file
+    condensed = np.load(output_name, mmap_mode='r') if len(ids) > 1 else np.load(output_name)
+    return (ids, condensed)
+
+def export_distances(condensed, ids, file_name='genetic-distances.txt'):
+    '''
+    Description:
+        This function writes a condensed matrix in the genetic-distances text format of save_distances, a row at a
+        time.
+
+    Parameters:
+        - condensed (np.ndarray): the condensed distance matrix
+        - ids (list(str)): the tip ids, in order
+        - file_name (str)(optional): the path of the text file. Default to genetic-distances.txt
+    '''
+    size = len(ids)
+
+    with open(file_name, 'w') as output:
+        # write first header line
+        line = '\t'.join([str(tip) for tip in ids])
+        output.write('\t' + line + '\n')
+
+        for row in range(size):
+            # the distances before the diagonal are spread over the previous rows, the ones after are contiguous
+            before = condensed[condensed_index(np.arange(row), row, size)].tolist()
+            start = condensed_index(row, row + 1, size)
+            after = condensed[start:start + size - row - 1].tolist()
+
+            line = str(ids[row]) + '\t'
+            line += '\t'.join([str(value) for value in before + [0] + after])
+            output.write(line + '\n')
+
+def encode_alignment(data):
+    '''
+    Description:
+        This function loads the aligned sequences into a matrix of character codes.
+
+    Parameters:
+        - data (list(list)): the sequence tips data in the format [[tip_id, sequence], ... , [last_tip_id, last_sequence]]
+
+    Returns:
+        - codes (np.ndarray): the N x L uint8 character codes, one row per sequence (they're all the same length)
+    '''
+    seqLength = len(data[0][1]) if data else 0
+    return np.frombuffer(''.join(sequence[1] for sequence in data).encode('latin-1'), dtype=np.uint8).reshape(len(data), seqLength)
+
+def count_matches(codes, rows=None, cols=None):
+    '''
+    Description:
+        This function counts the matching positions of every pair of sequences, for a block of rows against a block
+        of columns at a time by broadcasting. Only the blocks on or above the diagonal are computed.
+
+    Parameters:
+        - codes (np.ndarray): the N x L uint8 character codes of the sequences
+        - rows (tuple)(optional): the (start, stop) of the rows to compare. Default to None, all of them.
+        - cols (tuple)(optional): the (start, stop) of the columns to compare. Default to None, all of them.
+
+    Returns:
+        - same (np.ndarray): the rows x cols number of matching positions, above the diagonal (and within the diagonal
+            blocks)
+    '''
+    size, seqLength = codes.shape
+    rows, cols = rows or (0, size), cols or (0, size)
+    same = np.zeros((rows[1] - rows[0], cols[1] - cols[0]), dtype=np.int64)
+
+    # rows per block, so a block x block x L comparison stays within BLOCK_BYTES
+    block = max(1, int((BLOCK_BYTES / max(seqLength, 1)) ** 0.5))
+
+    for i in range(rows[0], rows[1], block):
+        for j in range(cols[0], cols[1], block):
+            # below the diagonal
+            if j + block <= i: continue
+
+            row_end, col_end = min(i + block, rows[1]), min(j + block, cols[1])
+            matches = codes[i:row_end, None, :] == codes[None, j:col_end, :]
+            same[i-rows[0]:row_end-rows[0], j-cols[0]:col_end-cols[0]] = matches.sum(axis=2)
+
+    return same
+
+def pack_alignment(codes):
+    '''
+    Description:
+        This function packs the sequences 2 bits per base, 32 bases per uint64 word (base k of a word in bits 2k and
+        2k + 1). A, C, G and T are packed as 0 - 3 in the bases plane. Any other character (gaps, N, ...) sets bit
+        2k of the mask plane and is packed as its index among the other characters, so two positions are the same
+        character exactly when both planes match. The sequences are padded with A to whole words.
+
+    Parameters:
+        - codes (np.ndarray): the N x L uint8 character codes of the sequences
+
+    Returns:
+        - (tuple or None): the N x W uint64 (bases, mask) planes, or None when the alignment has more than 4 characters
+            besides ACGT
+    '''
+    size, seqLength = codes.shape
+
+    lookup = np.full(256, 255, dtype=np.uint8)
+    lookup[np.frombuffer(b'ACGT', dtype=np.uint8)] = np.arange(4)
+
+    values = np.zeros((size, -(-seqLength // 32) * 32), dtype=np.uint8)
+    values[:, :seqLength] = lookup[codes]
+    mask = values == 255
+
+    # index the other characters among themselves
+    others = np.unique(codes[mask[:, :seqLength]])
+    if len(others) > 4: return None
+    values[mask] = np.searchsorted(others, codes[mask[:, :seqLength]])
+
+    # 4 bases per byte, and 8 bytes per little-endian word (the shape is spelled out, as -1 is ambiguous with no
+    # sequences)
+    planes = []
+    for plane in (values, mask.view(np.uint8)):
+        plane = plane.reshape(size, plane.shape[1] // 4, 4)
+        packed = plane[:, :, 0] | (plane[:, :, 1] << 2) | (plane[:, :, 2] << 4) | (plane[:, :, 3] << 6)
+        planes.append(np.ascontiguousarray(packed).view('<u8'))
+
+    return tuple(planes)
+
+def count_mismatches(bases, mask, rows=None, cols=None):
+    '''
+    Description:
+        This function counts the mismatching positions of every pair of packed sequences, a tile of rows against a
+        tile of columns at a time. The words of two sequences are XORed, the two bits of each base folded onto its
+        even bit along with the XOR of the mask planes, and the mismatches popcounted, 32 bases per operation. Only
+        the tiles on or above the diagonal are computed.
+
+    Parameters:
+        - bases (np.ndarray): the N x W uint64 bases plane, from pack_alignment
+        - mask (np.ndarray): the N x W uint64 mask plane, from pack_alignment
+        - rows (tuple)(optional): the (start, stop) of the rows to compare. Default to None, all of them.
+        - cols (tuple)(optional): the (start, stop) of the columns to compare. Default to None, all of them.
+
+    Returns:
+        - mismatches (np.ndarray): the rows x cols number of mismatching positions, above the diagonal (and within the
+            diagonal tiles)
+    '''
+    size, words = bases.shape
+    rows, cols = rows or (0, size), cols or (0, size)
+    mismatches = np.zeros((rows[1] - rows[0], cols[1] - cols[0]), dtype=np.int64)
+
+    # rows per tile, so a tile x tile x W comparison stays within TILE_BYTES
+    tile = max(1, int((TILE_BYTES / max(8 * words, 1)) ** 0.5))
+
+    for i in range(rows[0], rows[1], tile):
+        for j in range(cols[0], cols[1], tile):
+            # below the diagonal
+            if j + tile <= i: continue
+
+            row_end, col_end = min(i + tile, rows[1]), min(j + tile, cols[1])
+            difference = bases[i:row_end, None, :] ^ bases[None, j:col_end, :]
+            difference |= difference >> np.uint64(1)
+            difference |= mask[i:row_end, None, :] ^ mask[None, j:col_end, :]
+            difference &= EVEN_BITS
+            mismatches[i-rows[0]:row_end-rows[0], j-cols[0]:col_end-cols[0]] = popcount(difference).sum(axis=2)
+
+    return mismatches
+
+def popcount(words):
+    '''
+    Description:
+        This function counts the set bits of each uint64 word, with numpy's bitwise_count when available (numpy 2),
+        or else a lookup table of the bits set in each byte.
+
+    Parameters:
+        - words (np.ndarray): the uint64 words
+
+    Returns:
+        - (np.ndarray): the number of set bits of each word
+    '''
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+
+    return BYTE_BITS[words.view(np.uint8)].reshape(*words.shape, 8).sum(axis=-1)
+
 def save_distances(matrix, data, size):
     '''
     Description:
@@ -92,4 +424,14 @@ def save_distances(matrix, data, size):
         for row in range(size):
             line = str(data[row][0]) + '\t'
             line += '\t'.join([str(matrix[row][col]) for col in range(size)])
-            output.write(line + '\n')
\ No newline at end of file
+            output.write(line + '\n')
+
+if __name__ == '__main__':
+
+    # did not pass correct number of command line args
+    if (len(sys.argv) < 2):
+        print('Quitting... You must provide an .fna file')
+
+    # compute the condensed distance matrix over all cpus, and the text file when asked for
+    else:
+        compute_distances_parallel(open_file(sys.argv[1]), text=(len(sys.argv) > 2 and sys.argv[2] == 'text'))
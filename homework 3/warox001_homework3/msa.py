@@ -0,0 +1,282 @@
+import sys
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import distances
+import buildTree
+
+# traceback direction codes, the way each cell of the alignment matrix was reached
+DIAGONAL, UP, LEFT = 0, 1, 2
+
+# the needleman-wunsch scoring, every pair of residues of two columns scores a
+# match or a mismatch, and a residue against a gap scores a gap
+MATCH, MISMATCH, GAP = 1, -3, -2
+
+# the most memory (bytes) the traceback directions of one profile alignment may
+# use, one byte per cell of the (columns1 + 1) x (columns2 + 1) matrix
+MEMORY_BUDGET = 2 * 1024 ** 3
+
+def main(file_name, output_name='aligned.fna', workers=None):
+    '''
+    Description:
+        This function aligns the unaligned sequences of file_name progressively, and saves the aligned
+        sequences in the same format, ready for distances.compute_distances.
+
+    Parameters:
+        - file_name (str): the path to the .fna file of unaligned sequences
+        - output_name (str)(optional): the path of the aligned .fna file. Default to aligned.fna
+        - workers (int)(optional): the number of worker processes. Default to None, the number of cpus.
+    '''
+    data = distances.open_file(file_name)
+    aligned = progressive_align(data, workers)
+
+    with open(output_name, 'w') as file:
+        for (tip, sequence), row in zip(data, aligned):
+            file.write(f'>{tip}\n{row}\n')
+
+def progressive_align(data, workers=None):
+    '''
+    Description:
+        This function computes a multiple sequence alignment. The k-mer distances between the sequences
+        give a neighbor joining guide tree (buildTree.resolve_tree), and the profiles are merged up the
+        tree with profile_align, the most similar sequences first. Merges of independent subtrees are
+        spread over a process pool, each node being merged as soon as its children are.
+
+    Parameters:
+        - data (list(list)): the sequence tips data in the format [[tip_id, sequence], ... , [last_tip_id, last_sequence]]
+        - workers (int)(optional): the number of worker processes. Default to None, the number of cpus.
+
+    Returns:
+        - aligned (list(str)): the aligned sequences, in the order of data
+    '''
+    size = len(data)
+    alphabet = ''.join(sorted(set(''.join(row[1] for row in data)) - {'-'})) + '-'
+
+    # nothing to build a tree from
+    if size < 3:
+        return merge_profiles([[[i], [data[i][1]]] for i in range(size)], alphabet)[1] if size else []
+
+    # guide tree, the tips are numbered 1 - size and the root is size + 1
+    distance_matrix = kmer_distances([row[1] for row in data])
+    tree = buildTree.resolve_tree(distance_matrix, [str(row[0]) for row in data], False)
+
+    parent = {child[1]: node for node in tree for child in tree[node]}
+    waiting = {node: len(tree[node]) for node in tree} # children yet to be merged
+
+    # the (tip positions, aligned rows) profile of every merged node
+    profiles = {tip: [[tip - 1], [data[tip - 1][1]]] for tip in range(1, size + 1)}
+
+    with ProcessPoolExecutor(workers) as pool:
+        pending = {}
+
+        def finished(node):
+            # submit the parent once all of its children are profiles
+            node = parent.get(node)
+            if node is None: return
+            waiting[node] -= 1
+            if waiting[node] == 0:
+                children = [profiles.pop(child[1]) for child in tree[node]]
+                pending[pool.submit(merge_profiles, children, alphabet)] = node
+
+        for tip in range(1, size + 1):
+            finished(tip)
+
+        while pending:
+            done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                node = pending.pop(future)
+                profiles[node] = future.result()
+                finished(node)
+
+    # put the rows back in the order of data
+    positions, rows = profiles[size + 1]
+    aligned = [None] * size
+    for position, row in zip(positions, rows):
+        aligned[position] = row
+
+    return aligned
+
+def kmer_distances(sequences, k=4):
+    '''
+    Description:
+        This function estimates the distances between the unaligned sequences from their shared k-mers,
+        1 - (shared k-mers / most k-mers the shorter sequence could share), without aligning them.
+
+    Parameters:
+        - sequences (list(str)): the unaligned sequences
+        - k (int)(optional): the k-mer size. Default to 4.
+
+    Returns:
+        - matrix (list(list)): the distance matrix between each pair of sequences
+    '''
+    size = len(sequences)
+
+    # count the k-mers of every sequence, each distinct k-mer getting a column
+    columns = {}
+    rows = []
+    for sequence in sequences:
+        row = {}
+        for i in range(len(sequence) - k + 1):
+            column = columns.setdefault(sequence[i:i+k], len(columns))
+            row[column] = row.get(column, 0) + 1
+        rows.append(row)
+
+    counts = np.zeros((size, len(columns)), dtype=np.int32)
+    for i, row in enumerate(rows):
+        counts[i, list(row)] = list(row.values())
+
+    totals = counts.sum(axis=1)
+    matrix = np.zeros((size, size))
+    for i in range(size - 1):
+        shared = np.minimum(counts[i], counts[i+1:]).sum(axis=1)
+        possible = np.maximum(np.minimum(totals[i], totals[i+1:]), 1)
+        matrix[i, i+1:] = 1 - shared / possible
+
+    matrix += matrix.T
+    return matrix.tolist()
+
+def merge_profiles(profiles, alphabet):
+    '''
+    Description:
+        This function aligns profiles into a single one, one after the other with profile_align. It is
+        the unit of work handed to each worker process.
+
+    Parameters:
+        - profiles (list(list)): the [tip positions, aligned rows] of each profile
+        - alphabet (str): the residues of the sequences, ending with the gap '-'
+
+    Returns:
+        - profile (list): the [tip positions, aligned rows] of the merged profile
+    '''
+    positions, rows = profiles[0]
+    for other_positions, other_rows in profiles[1:]:
+        rows = profile_align(rows, other_rows, alphabet)
+        positions = positions + other_positions
+
+    return [positions, rows]
+
+def profile_align(profile1, profile2, alphabet, memory_budget=MEMORY_BUDGET):
+    '''
+    Description:
+        This function is needleman-wunsch generalized from aligning two sequences to aligning two profiles
+        (sets of aligned rows). Two columns score the sum over every pair of their residues (sum-of-pairs),
+        computed for all the column pairs at once from the residue counts of each column. Gaps are
+        inserted as whole columns of the other profile, scoring GAP for every residue they face.
+
+        The matrix is filled a row at a time: pairs and gaps from above only need the previous row, and
+        the best run of gaps from the left is a running maximum (maximum.accumulate) of the row's scores
+        minus the gap scores leading up to each column. The column pair scores are computed a row at a time
+        too, so only the directions take memory proportional to the matrix, one byte per cell, and alignments
+        whose directions would need more than memory_budget are refused.
+
+    Parameters:
+        - profile1 (list(str)): the aligned rows of profile 1
+        - profile2 (list(str)): the aligned rows of profile 2
+        - alphabet (str): the residues of the sequences, ending with the gap '-'
+        - memory_budget (int)(optional): the most memory (bytes) the traceback directions may use. None for no
+          limit. Default to MEMORY_BUDGET.
+
+    Returns:
+        - aligned (list(str)): the rows of profile1 then profile2, adjusted to be aligned with each other
+    '''
+    # score of each residue (and the gap, last) against each other one
+    scores = np.full((len(alphabet), len(alphabet)), MISMATCH, dtype=np.int64)
+    np.fill_diagonal(scores, MATCH)
+    scores[-1, :] = scores[:, -1] = GAP
+    scores[-1, -1] = 0
+
+    counts1 = column_counts(profile1, alphabet)
+    counts2 = column_counts(profile2, alphabet)
+    weighted1 = counts1 @ scores
+    counts2_t = np.ascontiguousarray(counts2.T)
+
+    gap1 = weighted1[:, -1] * len(profile2) # a column of profile 1 against a column of gaps
+    gap2 = (counts2 @ scores)[:, -1] * len(profile1) # a column of profile 2 against a column of gaps
+
+    height, width = len(gap1), len(gap2)
+    if memory_budget is not None and (height + 1) * (width + 1) > memory_budget:
+        raise ValueError(f'aligning profiles of {height} and {width} columns needs more than {memory_budget} bytes')
+
+    # the gap scores from the first column to each column
+    offsets = np.zeros(width + 1, dtype=np.int64)
+    np.cumsum(gap2, out=offsets[1:])
+
+    directions = np.empty((height + 1, width + 1), dtype=np.uint8)
+    directions[0] = LEFT
+    directions[0, 0] = DIAGONAL
+
+    best = offsets.copy() # the first row is all gaps from the left
+    diagonal = np.empty(width + 1, dtype=np.int64)
+    diagonal[0] = np.iinfo(np.int64).min // 4
+
+    for row in range(1, height + 1):
+        up = best + gap1[row - 1]
+        # every column of profile 2 against this column of profile 1
+        np.add(best[:-1], weighted1[row - 1] @ counts2_t, out=diagonal[1:])
+
+        # best[col] = max over start <= col of (max(up, diagonal)[start] + the gaps from start to col)
+        rest = np.maximum(up, diagonal)
+        best = np.maximum.accumulate(rest - offsets) + offsets
+
+        # above wins ties, then left, then diagonal
+        step = np.full(width + 1, DIAGONAL, dtype=np.uint8)
+        step[1:][best[1:] == best[:-1] + gap2] = LEFT
+        step[best == up] = UP
+        directions[row] = step
+
+    # move back through the matrix, collecting the column of each profile in every aligned column (the
+    # extra last column of each profile is all gaps)
+    columns1, columns2 = [], []
+    row, col = height, width
+    while row > 0 or col > 0:
+        step = directions[row, col]
+
+        if step == UP:
+            row -= 1
+            columns1.append(row)
+            columns2.append(width)
+        elif step == LEFT:
+            col -= 1
+            columns1.append(height)
+            columns2.append(col)
+        else:
+            row -= 1
+            col -= 1
+            columns1.append(row)
+            columns2.append(col)
+
+    aligned = []
+    for profile, columns, length in ((profile1, columns1, height), (profile2, columns2, width)):
+        characters = np.array([list(sequence + '-') for sequence in profile]).reshape(len(profile), length + 1)
+        aligned += [''.join(characters) for characters in characters[:, columns[::-1]]]
+
+    return aligned
+
+def column_counts(profile, alphabet):
+    '''
+    Description:
+        This function counts the residues (and gaps) in each column of a profile.
+
+    Parameters:
+        - profile (list(str)): the aligned rows of the profile
+        - alphabet (str): the residues of the sequences, ending with the gap '-'
+
+    Returns:
+        - counts (np.ndarray): the (columns x alphabet) counts
+    '''
+    characters = np.array([list(sequence) for sequence in profile]).reshape(len(profile), -1)
+
+    counts = np.empty((characters.shape[1], len(alphabet)), dtype=np.int64)
+    for index, residue in enumerate(alphabet):
+        counts[:, index] = (characters == residue).sum(axis=0)
+
+    return counts
+
+if __name__ == '__main__':
+
+    # did not pass correct number of command line args
+    if (len(sys.argv) < 2):
+        print('Quitting... You must provide an .fna file')
+
+    # run program
+    else:
+        main(*sys.argv[1:3])
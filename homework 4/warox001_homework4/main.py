@@ -1,7 +1,12 @@
-import sys
+import sys, os
 import matplotlib.pyplot as plt
 from operator import itemgetter
 
+# the compressed file readers are shared by every homework (seqio.py, two
+# directories up)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from seqio import open_text
+
 def main(sequence_file):
     '''
     Description:
@@ -34,7 +39,7 @@ def calculate_conservation_rate(in_file):
     seq_size = 0
 
     # get the length of sequences
-    with open(in_file, 'r') as file:
+    with open_text(in_file) as file:
         line = file.readline()
 
         while '>' in line:
@@ -50,7 +55,7 @@ def calculate_conservation_rate(in_file):
     num_sequences = 0
 
     # open the file and count ACTG occurences at each position of each sequence
-    with open(in_file, 'r') as file:
+    with open_text(in_file) as file:
         line = file.readline()
 
         while line:
@@ -0,0 +1,161 @@
+import io, gzip, struct, zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Readers of compressed sequence files, shared by every homework. Each homework
+# puts this directory on its import path and imports open_text from here.
+
+def open_text(file_name, workers=4):
+    '''
+    Description:
+        This function opens a sequence file for reading as text. Plain text,
+        gzip (.gz) and BGZF compressed files are all supported, the format
+        being detected from the file's first bytes.
+
+    Parameters:
+        - file_name (str): the path to the sequence file
+        - workers (int): the number of threads decompressing BGZF blocks
+
+    Returns:
+        - (file): the opened text file
+    '''
+    with open(file_name, 'rb') as probe:
+        header = probe.read(14)
+
+    # not gzip compressed
+    if header[:2] != b'\x1f\x8b':
+        return open(file_name)
+
+    # BGZF blocks are gzip members with a 'BC' extra subfield, and can be
+    # inflated independently
+    if len(header) == 14 and header[3] & 4 and header[12:14] == b'BC':
+        return io.TextIOWrapper(io.BufferedReader(BgzfReader(file_name, workers)))
+
+    return gzip.open(file_name, 'rt')
+
+def read_bgzf_blocks(file_name):
+    '''
+    Description:
+        This function reads the raw deflate data of each block of a BGZF file.
+
+    Parameters:
+        - file_name (str): the path to the BGZF compressed file
+
+    Returns:
+        - (generator(tuple)): the (compressed data, crc32, size) of each block, in
+            file order, the last two from the block's trailer
+    '''
+    with open(file_name, 'rb') as file:
+        header = file.read(12)
+        while len(header) == 12:
+            extra_size = struct.unpack('<H', header[10:12])[0]
+            extra = file.read(extra_size)
+
+            # find the BC subfield, which holds the total block size - 1
+            block_size, position = None, 0
+            while position + 4 <= extra_size:
+                subfield_size = struct.unpack('<H', extra[position+2:position+4])[0]
+                if extra[position:position+2] == b'BC':
+                    block_size = struct.unpack('<H', extra[position+4:position+6])[0]
+                position += 4 + subfield_size
+
+            if block_size is None:
+                raise ValueError(f'{file_name} is not a BGZF file')
+
+            # block = 12 byte header + extra field + deflate data + 8 byte
+            # crc32 & size trailer
+            data = file.read(block_size - extra_size - 19)
+            trailer = file.read(8)
+            if len(trailer) < 8:
+                raise ValueError(f'{file_name} is truncated')
+
+            yield (data, *struct.unpack('<II', trailer))
+            header = file.read(12)
+
+        # a partial header, the file was cut off
+        if header:
+            raise ValueError(f'{file_name} is truncated')
+
+def inflate_bgzf(file_name, workers=4):
+    '''
+    Description:
+        This function decompresses the blocks of a BGZF file in parallel worker
+        threads (zlib releases the GIL), yielding them back in file order. Only
+        a bounded number of blocks are in flight at a time.
+
+    Parameters:
+        - file_name (str): the path to the BGZF compressed file
+        - workers (int): the number of decompression threads
+
+    Returns:
+        - (generator(bytes)): the decompressed data of each block, in file order
+    '''
+    with ThreadPoolExecutor(workers) as pool:
+        pending = deque()
+        for block, crc, size in read_bgzf_blocks(file_name):
+            pending.append(pool.submit(inflate_block, block, crc, size, file_name))
+            if len(pending) > 4 * workers:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+def inflate_block(block, crc, size, file_name):
+    '''
+    Description:
+        This function decompresses one BGZF block and checks it against the
+        crc32 and size of its trailer, so corrupt or truncated data is never
+        parsed as sequence.
+
+    Parameters:
+        - block (bytes): the raw deflate data of the block
+        - crc (int): the crc32 of the decompressed data, from the trailer
+        - size (int): the size of the decompressed data, from the trailer
+        - file_name (str): the path to the BGZF compressed file (for the error message)
+
+    Returns:
+        - data (bytes): the decompressed data of the block
+    '''
+    try:
+        data = zlib.decompress(block, -15)
+    except zlib.error as e:
+        raise ValueError(f'{file_name} has a corrupt BGZF block: {e}')
+
+    if len(data) != size or zlib.crc32(data) != crc:
+        raise ValueError(f'{file_name} has a corrupt BGZF block (crc32/size mismatch)')
+
+    return data
+
+class BgzfReader(io.RawIOBase):
+    '''
+    Description:
+        Readable binary stream over the decompressed contents of a BGZF file,
+        so the parsers can read it like any other file.
+
+    Parameters:
+        - file_name (str): the path to the BGZF compressed file
+        - workers (int): the number of decompression threads
+    '''
+    def __init__(self, file_name, workers=4):
+        self.blocks = inflate_bgzf(file_name, workers)
+        self.buffer = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        # move on to the next non-empty block once this one is used up
+        while not self.buffer:
+            block = next(self.blocks, None)
+            if block is None:
+                return 0
+            self.buffer = memoryview(block)
+
+        size = min(len(b), len(self.buffer))
+        b[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+    def close(self):
+        self.blocks.close()
+        super().close()